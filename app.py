@@ -1,13 +1,21 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, get_flashed_messages
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, get_flashed_messages, Response, stream_with_context
 import openai
 import os
+import json
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
 from backend.data_fetcher import Data_Fetcher, LocationError, ForecastError
-from backend.user import User, load_users, save_users, find_user_by_email
+from backend.user import User
+from backend.user_store import upsert_user, delete_user
 from backend.summarizer import Summarizer
 from backend.main import main_loop
+from backend.http_pool import close_sessions
+from backend.smtp_pool import close_smtp_pool
+from backend.context_store import context_store
+from backend.explanation_cache import explanation_stats
+from backend.afd_poller import afd_poller, poll_afds, AFD_POLL_SECONDS
+from backend.outbox import deliver_outbox, OUTBOX_DELIVER_SECONDS
 from datetime import datetime
 
 load_dotenv()
@@ -103,33 +111,23 @@ def submit_emailbot():
         }
     )
 
-    # load in the users and check if they already exist, if they do just update
-    users = load_users()
-    existing_user = find_user_by_email(user.email, users)
-    if existing_user:
-        users = [u for u in users if u.email != user.email]
-        flash("Your preferences have been saved!", "signup")
-    else:
+    # one row insert, or update if the email already exists
+    if upsert_user(user):
         flash("You have successsfully signed up!", "signup")
-    users.append(user)
-    
-    # save the users
-    save_users(users)
+    else:
+        flash("Your preferences have been saved!", "signup")
     return redirect(url_for("emailbot"))
 
 @app.route("/unsubscribe", methods=["POST"])
 def unsubscribe():
     ''' 
-    Handles removing from email list. email list is stored in users.json at /mnt/data/users.json
+    Handles removing from email list. email list is stored in the sqlite user database at /mnt/data/users.db
 
     @return reload the emailbot page and show message successfully been unsubscribed
     '''
     email = request.form.get("unsubscribe_email")
-    # delete user from list
-    users = load_users()
-    users = [u for u in users if u.email != email]
-    # save list
-    save_users(users)
+    # delete the users row
+    delete_user(email)
     # show message
     flash("You have been unsubscribed.", "unsubscribe")
     return redirect(url_for("emailbot"))
@@ -343,17 +341,121 @@ def get_summary():
     df = Data_Fetcher(loc, units)
     forecast_discussion, *_ = df.get_forecast()
     if forecast_discussion is not None:
-        summarizer = Summarizer(expertise, forecast_discussion)
+        # office + issuance time let the summarizer reuse a summary of this afd that was already made at this level
+        summarizer = Summarizer(expertise, forecast_discussion, df.forecast_office, df.afd_issuance_time)
+        # keep summaries of this offices next afds ready for a while
+        afd_poller.note_visit(df.forecast_office, expertise)
     else:
         return jsonify({"error": "Missing afd"}), 400
 
     summary = f"Forecast Summary for {location}\n\n"
     summary += summarizer.generate_Message()
 
+    # explanations of this summary only need to send back the context id
+    context_id = context_store.register(forecast_discussion, summary, expertise, df.afd_issuance_time)
+
     return jsonify({
         "summary": summary,
         "afd": forecast_discussion,
-        "expertise": expertise
+        "expertise": expertise,
+        "context_id": context_id
+    })
+
+@app.route("/get-summary-stream", methods=["POST"])
+def get_summary_stream():
+    '''
+    Streaming version of /get-summary. Takes the same form fields but answers with server-sent events so the page can show the
+    summary as the LLM writes it. Events are
+        - meta - {"afd": full afd text, "expertise": level}, sent first
+        - text - {"text": next piece of the summary}
+        - done - {"context_id": id to send to the explanation routes} once the summary is finished
+
+    @return text/event-stream response, or a json error before the stream starts if the forecast could not be fetched
+    '''
+    location = request.form.get("location")
+    lat = request.form.get("latitude")
+    lon = request.form.get("longitude")
+    expertise = request.form.get("expertise")
+    units = request.form.get("units")
+
+    if lat and lon:
+        loc = f"{lat},{lon}"  # Prefer coords
+    elif location:
+        loc = location  # Fallback to location
+    else:
+        return jsonify({"error": "No location provided"}), 400
+
+    # fetch before the stream starts so errors can still be sent back as a normal json error
+    try:
+        df = Data_Fetcher(loc, units)
+        forecast_discussion, *_ = df.get_forecast()
+    except LocationError as le:
+        return jsonify({"error": str(le)}), 400
+    except ForecastError as fe:
+        return jsonify({"error": str(fe)}), 503
+    if forecast_discussion is None:
+        return jsonify({"error": "Missing afd"}), 400
+    summarizer = Summarizer(expertise, forecast_discussion, df.forecast_office, df.afd_issuance_time)
+    afd_poller.note_visit(df.forecast_office, expertise)
+
+    def events():
+        summary = f"Forecast Summary for {location}\n\n"
+        yield sse_event("meta", {"afd": forecast_discussion, "expertise": expertise})
+        yield sse_event("text", {"text": summary})
+        for piece in summarizer.stream_Message():
+            summary += piece
+            yield sse_event("text", {"text": piece})
+        yield sse_event("done", {"context_id": context_store.register(forecast_discussion, summary, expertise, df.afd_issuance_time)})
+
+    return sse_response(events())
+
+@app.route("/explain-text-stream", methods=["POST"])
+def explain_selected_text_stream():
+    '''
+    Streaming version of /explain-text. Takes the same json body and answers with server-sent text events holding pieces of the
+    explanation, followed by a done event with the context id to use next time.
+
+    @return text/event-stream response, or a json error if fields are missing (400) or the context expired (410)
+    '''
+    data = request.get_json()
+    selected_text = data.get("text", "").strip()
+    if not selected_text:
+        return jsonify({"explanation": "Missing required fields"}), 400
+
+    context, context_id = explanation_context(data)
+    if context is None:
+        return context_error(data)
+
+    summarizer = Summarizer(context["expertise"], context["afd"], issuance_time=context.get("issuance_time"))
+    regenerate = bool(data.get("regenerate"))
+
+    def events():
+        for piece in summarizer.stream_explanation(selected_text, context["summary"], regenerate):
+            yield sse_event("text", {"text": piece})
+        print(f"Explanation cache: {explanation_stats()}")
+        yield sse_event("done", {"context_id": context_id})
+
+    return sse_response(events())
+
+def sse_event(event, data):
+    '''
+    Formats one server-sent event. Data is json encoded so newlines in the text can not break the event framing
+
+    @param event the event name
+    @param data json serializable event data
+    @return the event string
+    '''
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    '''
+    @param events generator of sse_event() strings
+    @return flask response that streams the events to the browser as they are generated
+    '''
+    return Response(stream_with_context(events), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # stop proxies like nginx from buffering the stream
+        "X-Accel-Buffering": "no"
     })
 
 
@@ -431,36 +533,68 @@ def make_hourly_split(start_time, end_time, hourly_forecast):
 @app.route("/explain-text", methods=["POST"])
 def explain_selected_text():
     '''
-    Handles collecting data from input, including the selected peice of text, the summary & afd for context. Also uses expertise
-    for the level of expertise. This is passed into a summarizer object to generate the explanation.
+    Handles collecting data from input, including the selected peice of text and the context id from /get-summary, which points
+    at the summary, afd, & expertise kept on the server. Pages that do not have a context id can still send the summary, afd, and
+    expertise fields instead. This is passed into a summarizer object to generate the explanation. Repeat selections get the
+    cached explanation unless "regenerate" is true.
 
-    @return text explanation - "explanation"
+    @return text explanation - "explanation", and the "context_id" to send with the next explanation. 410 if the context expired
     '''
     data = request.get_json()
     selected_text = data.get("text", "").strip()
-    summary = data.get("summary", "")
-    forecast = data.get("afd", "")
-    expertise = data.get("expertise", "")
-
-    if not selected_text or not summary or not forecast or not expertise:
+    if not selected_text:
         return jsonify({"explanation": "Missing required fields"}), 400
 
-    if not summary or not forecast or not expertise:
-        return jsonify({"explanation": "Session expired or incomplete"}), 400
+    context, context_id = explanation_context(data)
+    if context is None:
+        return context_error(data)
 
     # pass to summarizer objext to explain the text 
-    summarizer = Summarizer(expertise, forecast)
-    explanation = summarizer.explain_text(selected_text, summary) 
-    return jsonify({"explanation": explanation})
+    summarizer = Summarizer(context["expertise"], context["afd"], issuance_time=context.get("issuance_time"))
+    explanation = summarizer.explain_text(selected_text, context["summary"], bool(data.get("regenerate"))) 
+    print(f"Explanation cache: {explanation_stats()}")
+    return jsonify({"explanation": explanation, "context_id": context_id})
     #return jsonify({"explanation": "test -- works"})
 
+def explanation_context(data):
+    '''
+    Finds the afd, summary, and expertise an explanation request is about. Requests with a context_id are looked up in the
+    context store, requests that send the full summary, afd, and expertise get a new context registered for them.
+
+    @param data the explanation request json
+    @return (context dictionary, context id), context is None if the id expired or the request is missing fields
+    '''
+    context_id = data.get("context_id")
+    if context_id:
+        return context_store.get(context_id), context_id
+
+    summary = data.get("summary", "")
+    forecast = data.get("afd", "")
+    expertise = data.get("expertise", "")
+    if not summary or not forecast or not expertise:
+        return None, None
+    return {"afd": forecast, "summary": summary, "expertise": expertise}, context_store.register(forecast, summary, expertise)
+
+def context_error(data):
+    '''
+    @param data the explanation request json that explanation_context() could not find a context for
+    @return the json error response, 410 if the context id expired so the page knows to resend the full context
+    '''
+    if data.get("context_id"):
+        return jsonify({"explanation": "Session expired or incomplete", "expired": True}), 410
+    return jsonify({"explanation": "Missing required fields"}), 400
+
 
 # start scheduler when Flask starts
 scheduler = BackgroundScheduler()
 scheduler.add_job(func=main_loop, trigger="interval", seconds=120) # trigger every 120 seconds, could prob be less frequent.
+scheduler.add_job(func=poll_afds, trigger="interval", seconds=AFD_POLL_SECONDS) # summarize new afds before anyone asks for them
+scheduler.add_job(func=deliver_outbox, trigger="interval", seconds=OUTBOX_DELIVER_SECONDS) # send queued emails, retry failed ones
 scheduler.start()
 
 atexit.register(lambda: scheduler.shutdown())
+atexit.register(close_sessions)
+atexit.register(close_smtp_pool)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+import os
+import re
+'''
+Area forecast discussion parser. NWS AFDs are broken up into dot headed sections (.SYNOPSIS..., .NEAR TERM /THROUGH TONIGHT/...,
+.AVIATION..., etc...) that end with &&, and the product itself ends with $$ followed by the forecaster names. Sending the whole raw
+product to the LLM pays for WMO headers, watch/warning boilerplate, and aviation/marine detail that most summaries never use, so
+the summarizer builds its prompt from just the sections each knowledge level needs, capped at a token budget.
+'''
+AFD_TOKEN_BUDGET = int(os.getenv("AFD_TOKEN_BUDGET", "2500"))
+''' Max (estimated) tokens of afd text put into a single LLM prompt'''
+CHARS_PER_TOKEN = 4
+''' Rough number of characters of english text per LLM token, good enough for budgeting'''
+
+SECTION_PRIORITY = {
+    "expert": ["KEY MESSAGES", "SYNOPSIS", "DISCUSSION", "UPDATE", "NEAR TERM", "SHORT TERM", "LONG TERM", "AVIATION",
+               "FIRE WEATHER", "MARINE"],
+    "moderate": ["KEY MESSAGES", "SYNOPSIS", "DISCUSSION", "UPDATE", "NEAR TERM", "SHORT TERM", "LONG TERM"],
+    "none": ["KEY MESSAGES", "SYNOPSIS", "DISCUSSION", "UPDATE", "NEAR TERM", "SHORT TERM", "LONG TERM"],
+}
+''' Sections each knowledge level needs, most important first. Sections that are not listed are never sent to the LLM'''
+
+# ".NEAR TERM /THROUGH TONIGHT/...text" -> title "NEAR TERM /THROUGH TONIGHT/", rest "text"
+_SECTION_RE = re.compile(r"^\.([A-Z][^.\n]*?)\.\.\.(.*)$")
+# "245 PM EDT Wed Jun 18 2025"
+_ISSUED_RE = re.compile(r"^\d{3,4} [AP]M [A-Z]{3,4} [A-Z][a-z]{2} [A-Z][a-z]{2} \d{1,2} \d{4}$")
+
+def estimate_tokens(text):
+    '''
+    @param text any string
+    @return rough number of LLM tokens in the text
+    '''
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def section_name(title):
+    '''
+    @param title section title from the afd, like "NEAR TERM /THROUGH TONIGHT/" or "RAH WATCHES/WARNINGS/ADVISORIES"
+    @return the title without its time period, "NEAR TERM"
+    '''
+    # time periods are always separated from the name by a space, watch/warning titles have slashes without one
+    return title.split(" /")[0].strip().upper()
+
+def parse_afd(text):
+    '''
+    Splits an area forecast discussion into its sections
+
+    @param text the afd productText from NWS
+    @return dictionary with issued (the issuance line, None if not found) and sections, a list of dictionaries with name, title,
+        and text in the order they appear in the afd
+    '''
+    issued = None
+    sections = []
+    current = None
+    for line in text.replace("\r", "").split("\n"):
+        stripped = line.strip()
+        # everything after $$ is forecaster names
+        if stripped == "$$":
+            break
+        if stripped == "&&":
+            current = None
+            continue
+        match = _SECTION_RE.match(stripped)
+        if match:
+            current = {"name": section_name(match.group(1)), "title": match.group(1).strip(), "lines": []}
+            if match.group(2).strip():
+                current["lines"].append(match.group(2).strip())
+            sections.append(current)
+        elif current is not None:
+            current["lines"].append(line.rstrip())
+        elif issued is None and _ISSUED_RE.match(stripped):
+            issued = stripped
+
+    parsed = []
+    for section in sections:
+        body = re.sub(r"\n{3,}", "\n\n", "\n".join(section["lines"])).strip()
+        if body:
+            parsed.append({"name": section["name"], "title": section["title"], "text": body})
+    return {"issued": issued, "sections": parsed}
+
+def truncate_to_budget(text, budget):
+    '''
+    Cuts text down to a token budget, on a paragraph boundary when possible
+
+    @param text the text to cut
+    @param budget max (estimated) tokens
+    @return the text, shortened if it did not fit
+    '''
+    max_chars = budget * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    paragraph = cut.rfind("\n\n")
+    if paragraph > max_chars // 2:
+        cut = cut[:paragraph]
+    return cut.rstrip() + "\n..."
+
+def compact_afd(text, weather_knowledge, budget=None):
+    '''
+    Builds the afd text sent to the LLM. Sections are picked in the levels priority order until the budget is used up, then put
+    back in the order the afd has them so the LLM still reads it top to bottom.
+
+    @param text the afd productText from NWS
+    @param weather_knowledge "expert", "moderate", or "none", anything else is treated as expert
+    @param budget max (estimated) tokens of afd text, AFD_TOKEN_BUDGET by default
+    @return the compacted afd, or the raw afd cut down to the budget if no sections could be found
+    '''
+    budget = AFD_TOKEN_BUDGET if budget is None else budget
+    parsed = parse_afd(text)
+    priority = SECTION_PRIORITY.get(weather_knowledge, SECTION_PRIORITY["expert"])
+    wanted = [section for section in parsed["sections"] if section["name"] in priority]
+    if not wanted:
+        return truncate_to_budget(text.strip(), budget)
+
+    header = f"Issued {parsed['issued']}\n\n" if parsed["issued"] else ""
+    remaining = budget - estimate_tokens(header)
+    chosen = {}
+    # stable sort keeps repeated sections (like two UPDATEs) in afd order
+    for section in sorted(wanted, key=lambda s: priority.index(s["name"])):
+        block = f".{section['title']}...\n{section['text']}"
+        cost = estimate_tokens(block) + 1
+        if cost <= remaining:
+            chosen[id(section)] = block
+            remaining -= cost
+        else:
+            # fit what we can of the next most important section, then stop
+            if remaining > 50:
+                chosen[id(section)] = truncate_to_budget(block, remaining)
+            break
+
+    return header + "\n\n".join(chosen[id(s)] for s in parsed["sections"] if id(s) in chosen)
@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+from backend.data_fetcher import Data_Fetcher, BASE_URL, USER_AGENT
+from backend.summary_cache import get_summary
+from backend.summary_executor import SummaryExecutor
+from backend.user_store import location_levels
+'''
+Background precomputation of summaries. Every few minutes the poller checks the afd product list of each office our email users
+and recent web visitors map to, and when an office has issued a new afd it summarizes it at every knowledge level in use there.
+The summaries land in the summary cache, so /get-summary and the email batch usually find them already made instead of waiting
+on the LLM.
+'''
+AFD_POLL_SECONDS = int(os.getenv("AFD_POLL_SECONDS", "300"))
+''' Seconds between checks for new afds'''
+ACTIVE_VISIT_SECONDS = int(os.getenv("ACTIVE_VISIT_SECONDS", str(6 * 3600)))
+''' How long an office & level keeps being precomputed after a web visitor asked for it'''
+
+class AFDPoller:
+    '''
+    AFDPoller Class. Remembers which offices and knowledge levels people are reading and keeps a summary of each offices latest
+    afd ready for them.
+    '''
+    def __init__(self, visit_seconds=ACTIVE_VISIT_SECONDS):
+        '''
+        AFDPoller object initialization method (constructor)
+
+        @param visit_seconds how long a web visit keeps its office & level active
+        '''
+        self.visit_seconds = visit_seconds
+        self._visits = {}
+        self._lock = threading.Lock()
+        # Data_Fetcher's request helper brings the nws response cache and request coalescing along with it
+        self._fetcher = Data_Fetcher(None, "imperial")
+        # location -> office from earlier polls, a location never changes office so it is only looked up the first time it is seen
+        self._offices = {}
+
+    def note_visit(self, office, weather_knowledge):
+        '''
+        Records that someone read a summary so the office & level get precomputed for a while
+
+        @param office three letter forecast office id
+        @param weather_knowledge the knowledge level they asked for
+        '''
+        if office and weather_knowledge and weather_knowledge != "no_summary":
+            with self._lock:
+                self._visits[(office, weather_knowledge)] = time.time()
+
+    def active_levels(self):
+        '''
+        @return dictionary of office -> set of knowledge levels that need summaries, from email users and recent web visitors
+        '''
+        active = {}
+        offices = {}
+        # one row per distinct location & level instead of every user, and each location resolved once
+        for location, level in location_levels():
+            if location not in offices:
+                try:
+                    offices[location] = self._offices.get(location) or office_for_location(location)
+                except Exception as e:
+                    print(f"Could not find the forecast office for {location}: {e}")
+                    offices[location] = None
+            if offices[location]:
+                active.setdefault(offices[location], set()).add(level)
+        # only the locations users still have are kept for the next poll
+        self._offices = {location: office for location, office in offices.items() if office}
+
+        cutoff = time.time() - self.visit_seconds
+        with self._lock:
+            for (office, level), seen in list(self._visits.items()):
+                if seen < cutoff:
+                    del self._visits[(office, level)]
+                else:
+                    active.setdefault(office, set()).add(level)
+        return active
+
+    def latest_afd(self, office):
+        '''
+        @param office three letter forecast office id
+        @return (product id, issuance time) of the offices newest afd, None if it has none
+        '''
+        listing = self._fetcher.make_request(f"{BASE_URL}/products/types/AFD/locations/{office}", USER_AGENT)
+        products = listing.get('@graph') or []
+        if not products:
+            return None
+        return products[0]['id'], products[0]['issuanceTime']
+
+    def poll(self):
+        '''
+        Checks every active office for a new afd and summarizes it at each of the offices active levels that is not cached yet
+        '''
+        with SummaryExecutor() as executor:
+            for office, levels in self.active_levels().items():
+                try:
+                    latest = self.latest_afd(office)
+                    if latest is None:
+                        continue
+                    product_id, issuance_time = latest
+                    missing = [level for level in levels if get_summary(office, issuance_time, level) is None]
+                    if not missing:
+                        continue
+                    # only pull the product text when something actually needs summarizing
+                    product = self._fetcher.make_request(f"{BASE_URL}/products/{product_id}", USER_AGENT)
+                    for level in missing:
+                        executor.submit(level, product['productText'], office, issuance_time)
+                except Exception as e:
+                    print(f"Failed to precompute summaries for {office}: {e}")
+            stats = executor.stats()
+        if stats["unique"]:
+            print(f"Precomputed {stats['unique']} summaries")
+
+def office_for_location(location):
+    '''
+    @param location a users zipcode, city, address, etc...
+    @return the three letter forecast office id for the location, geocoding and points lookups are cached so this is cheap
+        after the first time
+    '''
+    df = Data_Fetcher(location, "imperial")
+    coords = df.get_latlon()
+    if coords is None:
+        raise ValueError(f"could not geocode {location}")
+    metadata = df.get_points_metadata(coords[0], coords[1])
+    if not metadata:
+        raise ValueError(f"no NWS points data for {location}")
+    return metadata['office']
+
+# shared by the web routes (which note visits) and the scheduled poll job
+afd_poller = AFDPoller()
+
+def poll_afds():
+    '''
+    Scheduler entry point, runs one poll of the shared poller
+    '''
+    afd_poller.poll()
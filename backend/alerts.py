@@ -0,0 +1,208 @@
+import os
+import time
+import asyncio
+import threading
+'''
+National alert snapshot shared by every user. Instead of asking NWS for /alerts/active/zone/{zone} once per forecast, the whole
+/alerts/active feed is downloaded once per refresh interval, every alert is parsed once, and an index from UGC zone code to alerts
+is built so a forecast or email just does a dictionary lookup for its zone. A location is looked up by both its forecast zone
+(NCZ041) and its county (NCC183), many warnings (tornado, severe thunderstorm, flash flood) are only issued by county.
+'''
+ALERT_REFRESH_SECONDS = int(os.getenv("ALERT_REFRESH_SECONDS", "120"))
+''' Seconds the national alert snapshot is used before it is downloaded again'''
+ALERT_MAX_STALE_SECONDS = int(os.getenv("ALERT_MAX_STALE_SECONDS", "1800"))
+''' If a refresh fails, how old a snapshot can be and still be served instead of raising the error'''
+
+def parse_alert(alert):
+    '''
+    Pulls the important info out of a single alert feature
+
+    @param alert one feature from a NWS alerts response
+    @return dictionary with the alerts event, headline, description, timing, etc...
+    '''
+    prop = alert['properties']
+    params = prop.get('parameters', {})
+
+    # Grab most everything because not sure what we will need just yet
+    return {
+        'event': prop.get('event'),
+        'sender_name': prop.get('senderName'),
+        'area': (prop.get('areaDesc') or '').split('; '),
+        'severity': prop.get('severity'),
+        'certainty': prop.get('certainty'),
+        'urgency': prop.get('urgency'),
+        'status': prop.get('status'),
+        'message_type': prop.get('messageType'),
+        'onset': prop.get('onset'),
+        'ends': prop.get('ends'),
+        'effective': prop.get('effective'),
+        'expires': prop.get('expires'),
+        'headline': prop.get('headline'),
+        'description': prop.get('description'),
+        'instruction': prop.get('instruction'),
+        'response': prop.get('response'),
+        'web': prop.get('web'),
+        'vtec': params.get('VTEC', [None])[0],
+    }
+
+def index_alerts(watch_data):
+    '''
+    Parses every alert in a NWS alerts response and indexes them by the UGC zone codes they cover
+
+    @param watch_data the alerts json response
+    @return dictionary of zone code -> list of parsed alerts affecting that zone
+    '''
+    index = {}
+    for alert in watch_data['features']:
+        organized_alert = parse_alert(alert)
+        ugc_codes = (alert['properties'].get('geocode') or {}).get('UGC') or []
+        for zone_id in ugc_codes:
+            index.setdefault(zone_id, []).append(organized_alert)
+    return index
+
+def ugc_codes(*urls):
+    '''
+    @param urls nws zone urls like https://api.weather.gov/zones/county/NCC183, None entries are skipped
+    @return list of the UGC codes at the end of the urls
+    '''
+    return [url.rstrip('/').rsplit('/', 1)[-1] for url in urls if url]
+
+class AlertService:
+    '''
+    AlertService Class. Holds the latest national alert snapshot as a zone -> alerts index. The snapshot is refreshed lazily by
+    whichever caller first notices it is out of date, other callers keep reading the old one until the new one is swapped in.
+    '''
+    def __init__(self, refresh_interval=ALERT_REFRESH_SECONDS, max_stale=ALERT_MAX_STALE_SECONDS):
+        '''
+        AlertService object initialization method (constructor)
+
+        @param refresh_interval seconds a snapshot is used before it is downloaded again
+        @param max_stale seconds an old snapshot can still be served for when a refresh fails
+        '''
+        self.refresh_interval = refresh_interval
+        self.max_stale = max_stale
+        self._index = {}
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        '''
+        @return true if the snapshot is older than the refresh interval
+        '''
+        return time.time() - self._fetched_at >= self.refresh_interval
+
+    def load(self, watch_data):
+        '''
+        Replaces the snapshot with a freshly downloaded national alerts response
+
+        @param watch_data the /alerts/active json response
+        '''
+        index = index_alerts(watch_data)
+        self._index = index
+        self._fetched_at = time.time()
+
+    def refresh(self, fetch):
+        '''
+        Downloads a new snapshot if the current one is stale, only one thread does the download. While it does, other callers
+        return right away and keep using the old snapshot, unless there is none yet (or it is too old to serve) in which case they
+        wait for the download
+
+        @param fetch no argument function that returns the /alerts/active json response
+        '''
+        if not self.is_stale():
+            return
+        # a refresh is already in flight and there is a snapshot worth serving, dont wait on the national download
+        if not self._lock.acquire(blocking=not self.servable()):
+            return
+        try:
+            # someone else may have refreshed while we waited on the lock
+            if not self.is_stale():
+                return
+            try:
+                self.load(fetch())
+            except Exception as e:
+                self._refresh_failed(e)
+        finally:
+            self._lock.release()
+
+    async def refresh_async(self, fetch):
+        '''
+        Coroutine version of refresh() for AsyncDataFetcher, the download runs on the event loop and waiting on another
+        refresh happens on a worker thread so the loop is never blocked
+
+        @param fetch no argument coroutine function that returns the /alerts/active json response
+        '''
+        while self.is_stale():
+            if self._lock.acquire(blocking=False):
+                try:
+                    if self.is_stale():
+                        try:
+                            self.load(await fetch())
+                        except Exception as e:
+                            self._refresh_failed(e)
+                finally:
+                    self._lock.release()
+                return
+            if self.servable():
+                return
+            # no snapshot to serve, wait for the refresh in flight (another thread or coroutine) to finish and check again
+            await asyncio.to_thread(self._wait_for_refresh)
+
+    def servable(self):
+        '''
+        @return true if there is a snapshot young enough to serve while a refresh is in flight or after one failed
+        '''
+        return bool(self._fetched_at) and time.time() - self._fetched_at < self.max_stale
+
+    def _wait_for_refresh(self):
+        '''
+        Blocks until the refresh in flight is done, without holding the lock afterwards
+        '''
+        with self._lock:
+            pass
+
+    def _refresh_failed(self, error):
+        '''
+        Keeps serving the old snapshot after a failed download if it is not too old, otherwise raises the error
+
+        @param error exception the download raised
+        '''
+        # a slightly old snapshot beats failing the whole forecast
+        if self.servable():
+            print(f"Failed to refresh alerts, using the previous snapshot: {error}")
+            return
+        raise error
+
+    def alerts_for_zone(self, zone_id, fetch=None):
+        '''
+        Looks up the active alerts for a zone, refreshing the snapshot first if it is stale and fetch is given
+
+        @param zone_id UGC zone code like NCZ041
+        @param fetch no argument function that returns the /alerts/active json response
+        @return list of parsed alerts affecting the zone
+        '''
+        return self.alerts_for_zones([zone_id], fetch)
+
+    def alerts_for_zones(self, zone_ids, fetch=None):
+        '''
+        Looks up the active alerts for several UGC codes at once, a location's forecast zone and county
+
+        @param zone_ids list of UGC codes like ["NCZ041", "NCC183"]
+        @param fetch no argument function that returns the /alerts/active json response
+        @return list of parsed alerts affecting any of the codes, an alert covering more than one of them is only listed once
+        '''
+        if fetch is not None:
+            self.refresh(fetch)
+        index = self._index
+        alerts = []
+        seen = set()
+        for zone_id in zone_ids:
+            for alert in index.get(zone_id, []):
+                # the same parsed alert object is indexed under every code it covers
+                if id(alert) not in seen:
+                    seen.add(id(alert))
+                    alerts.append(alert)
+        return alerts
+
+# the snapshot shared by every Data_Fetcher / AsyncDataFetcher / email in the process
+alert_service = AlertService()
@@ -0,0 +1,310 @@
+import os
+import asyncio
+import httpx
+from backend.data_fetcher import (BASE_URL, USER_AGENT, LocationError, ForecastError, parse_coordinates, build_points_metadata,
+                                  parse_daily_forecast, cached_points_metadata, store_points_metadata)
+from backend.geocoder import NOMINATIM_URL, cached_geocode, remember_geocode, nominatim_params, parse_nominatim
+from backend.http_cache import response_cache
+from backend.http_pool import CONNECT_TIMEOUT, READ_TIMEOUT
+from backend.station_index import get_station_index
+from backend.rate_limiter import throttle_async
+from backend.alerts import alert_service, ugc_codes
+from backend.forecast_store import forecast_store
+'''
+asyncio version of Data_Fetcher built on httpx. Lets the email batch (or any async handler) pull forecasts for hundreds of locations
+concurrently on one thread instead of tying up a thread per request. Shares the geocode, points, and nws response caches with
+Data_Fetcher so the two can be mixed freely.
+'''
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "20"))
+''' Max number of open connections an async client keeps across all hosts'''
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "50"))
+''' Max number of forecasts fetch_forecasts() works on at the same time'''
+
+# nws requests in flight per event loop, so concurrent fetchers on the same loop share one request per url
+_in_flight = {}
+
+def make_async_client():
+    '''
+    Builds an httpx client with a keep-alive connection pool, meant to be shared by many AsyncDataFetchers
+
+    @return httpx.AsyncClient, close it with aclose() (or use it in an async with block) when done
+    '''
+    limits = httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_CONNECTIONS)
+    timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True)
+
+class AsyncDataFetcher:
+    '''
+    AsyncDataFetcher Class. Same public surface as Data_Fetcher (get_forecast, get_latlon, get_forecast_office) but every method is
+    a coroutine. Pass in a shared client from make_async_client() when fetching many locations, otherwise the fetcher makes its
+    own and it should be closed with aclose().
+    '''
+    def __init__(self, location, units, client=None):
+        '''
+        AsyncDataFetcher object initialization method (constructor)
+
+        @param location users zipcode, city, address, etc...
+        @param units used to specify units when pulling from nws
+        @param client shared httpx.AsyncClient, one is created if not given
+        '''
+        self.location = location
+        self.units = units
+        self._owns_client = client is None
+        self.forecast_office = None
+        self.afd_issuance_time = None
+        self.county_url = None
+        self.client = client or make_async_client()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        ''' Closes the http client if this fetcher created it '''
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def get_forecast(self):
+        '''
+        Async version of Data_Fetcher.get_forecast(), the five products are requested concurrently once the office is known
+
+        @return forecast_discussion, organized_alerts, daily_forecasts, obs_data, hourly_forecast (see Data_Fetcher.get_forecast)
+        '''
+        coords = await self.get_latlon()
+        if coords is None:
+            print("Failed to get coords")
+            raise LocationError("Could not find location. Please try a different input.")
+
+        try:
+            forecast_office, gridX, gridY, zone_url, obs_station = await self.get_forecast_office(coords[0], coords[1])
+            if not forecast_office:
+                raise ForecastError("Could not get forecast office info from NWS.")
+            self.forecast_office = forecast_office
+        except Exception as e:
+            print(f"Detailed ForecastError: {e}")
+            raise ForecastError("That location is likely outside the NWS coverage area or does not exist. Please try a different location in the U.S. May need to be more specific Ex: Raleigh, NC or Denver, CO")
+
+        results = await asyncio.gather(
+            self.get_discussion(forecast_office),
+            self.get_alerts(zone_url, self.county_url),
+            self.get_daily_forecast(forecast_office, gridX, gridY),
+            self.get_hourly_forecast(forecast_office, gridX, gridY),
+            self.get_observations(obs_station),
+            return_exceptions=True,
+        )
+        # same as the sync version, the first failure in request order is the one that gets raised
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        forecast_discussion, organized_alerts, daily_forecasts, hourly_forecast, obs_data = results
+
+        return forecast_discussion, organized_alerts, daily_forecasts, obs_data, hourly_forecast
+
+    async def get_discussion(self, forecast_office):
+        '''
+        @param forecast_office the three letter forecast office id
+        @return forecast_discussion string containing the most recent forecast discussion
+        '''
+        text_data = await self.make_request(f"{BASE_URL}/products/types/AFD/locations/{forecast_office}/latest", USER_AGENT)
+        self.afd_issuance_time = text_data['issuanceTime']
+        return text_data['productText']
+
+    async def get_alerts(self, zone_url, county_url=None):
+        '''
+        @param zone_url the warning zone url from get_forecast_office()
+        @param county_url the county zone url from get_forecast_office() (self.county_url)
+        @return organized_alerts list of dictionarys (1 dict for every alert) containing info on active alerts in the area
+        '''
+        zone_ids = ugc_codes(zone_url, county_url)
+        # the national feed comes over this fetchers httpx client, with the same one download at a time and old snapshot on
+        # failure rules as the sync fetcher
+        await alert_service.refresh_async(lambda: self.make_request(f"{BASE_URL}/alerts/active", USER_AGENT))
+        return alert_service.alerts_for_zones(zone_ids)
+
+    async def get_daily_forecast(self, forecast_office, gridX, gridY):
+        '''
+        @param forecast_office the three letter forecast office id
+        @param gridX stations x grid point
+        @param gridY stations y grid point
+        @return daily_forecasts list of dictionarys (1 dict for every forecast period) containing the basic daily forecast information
+        '''
+        url = f"{BASE_URL}/gridpoints/{forecast_office}/{gridX},{gridY}/forecast"
+        return parse_daily_forecast(await self.get_cell_forecast(url))
+
+    async def get_hourly_forecast(self, forecast_office, gridX, gridY):
+        '''
+        @param forecast_office the three letter forecast office id
+        @param gridX stations x grid point
+        @param gridY stations y grid point
+        @return hourly_forecast dictionary containing a list of periods with hourly forecast data
+        '''
+        url = f"{BASE_URL}/gridpoints/{forecast_office}/{gridX},{gridY}/forecast/hourly"
+        return await self.get_cell_forecast(url)
+
+    async def get_cell_forecast(self, url):
+        '''
+        Gets a gridpoint forecast thru the shared grid cell store, fetching it in us units if the cell is not stored
+
+        @param url the gridpoint forecast url without a units parameter
+        @return the forecast json in this fetchers units
+        '''
+        forecast_data = forecast_store.get(url, self.units)
+        if forecast_data is None:
+            fetched = await self.make_request(url, USER_AGENT)
+            forecast_store.put(url, fetched)
+            forecast_data = forecast_store.get(url, self.units, lambda _: fetched)
+        return forecast_data
+
+    async def get_observations(self, obs_station):
+        '''
+        @param obs_station the closest observation station feature from get_forecast_office()
+        @return obs_data dictionary containing information on the observations from the closest station.
+        '''
+        obs_id = obs_station['properties']['stationIdentifier']
+        return await self.make_request(f"{BASE_URL}/stations/{obs_id}/observations/latest", USER_AGENT)
+
+    async def get_latlon(self):
+        '''
+        Async version of Data_Fetcher.get_latlon(), uses the shared geocode cache before calling Nominatim
+
+        @return the lat lon in a tuple, None if the api call failed
+        '''
+        coords = parse_coordinates(self.location)
+        if coords:
+            return coords
+        # the geocode and points caches are file backed behind a file lock, their reads and writes go to a worker thread
+        coords = await asyncio.to_thread(cached_geocode, self.location)
+        if coords:
+            return coords
+
+        try:
+            await throttle_async(NOMINATIM_URL)
+            response = await self.client.get(NOMINATIM_URL, params=nominatim_params(self.location), headers={"User-Agent": "WeatherBearApp/1.0"}, timeout=10)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Error fetching lat/lon: {e}")
+            return None
+
+        coords = parse_nominatim(response.json())
+        if coords is None:
+            raise LocationError("Could not find that location. Try a different location or a more specific name like 'Raleigh, NC'.")
+        await asyncio.to_thread(remember_geocode, self.location, coords)
+        return coords
+
+    async def get_forecast_office(self, lat, lon):
+        '''
+        Async version of Data_Fetcher.get_forecast_office()
+
+        @param lat latitude of user
+        @param lon longitude of user
+        @return office, gridX, gridY, zone_url, closest_station
+        '''
+        metadata = await asyncio.to_thread(cached_points_metadata, lat, lon)
+        if metadata is None:
+            data = await self.make_request(f"{BASE_URL}/points/{lat},{lon}", USER_AGENT)
+            if not data:
+                print("Failed to Retrieve Data")
+                return None
+            obs_stations = await self.make_request(data['properties']['observationStations'], USER_AGENT)
+            metadata = build_points_metadata(data, obs_stations)
+            await asyncio.to_thread(store_points_metadata, lat, lon, metadata)
+
+        self.county_url = metadata.get('county_url')
+        closest_station = get_station_index(metadata['stations_url'], metadata['stations']).nearest(lat, lon)
+        return metadata['office'], metadata['gridX'], metadata['gridY'], metadata['zone_url'], closest_station
+
+    async def make_request(self, endpoint, user_agent):
+        '''
+        Async version of Data_Fetcher.make_request(), uses the same nws response cache and coalesces identical requests that are
+        in flight on this event loop
+
+        @param endpoint the url of api at desired point
+        @param user_agent a username that is used when calling api
+        @return the parsed json response, shared with the cache so it should not be modified
+        '''
+        cached = response_cache.fresh(endpoint)
+        if cached is not None:
+            return cached
+
+        key = (asyncio.get_running_loop(), endpoint)
+        task = _in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(endpoint, user_agent))
+            _in_flight[key] = task
+            task.add_done_callback(lambda _: _in_flight.pop(key, None))
+        # shield so one caller being cancelled doesnt cancel the request for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _fetch(self, endpoint, user_agent):
+        '''
+        Does the network request for make_request(), revalidating a stale cached response if there is one
+
+        @param endpoint the url of api at desired point
+        @param user_agent a username that is used when calling api
+        @return the parsed json response
+        '''
+        headers = {"User-Agent": user_agent}
+        headers.update(response_cache.validators(endpoint))
+        try:
+            await throttle_async(endpoint)
+            response = await self.client.get(endpoint, headers=headers)
+            response.raise_for_status()
+            if response.status_code == 304:
+                cached = response_cache.revalidated(endpoint, response.headers)
+                if cached is not None:
+                    return cached
+                await throttle_async(endpoint)
+                response = await self.client.get(endpoint, headers={"User-Agent": user_agent})
+                response.raise_for_status()
+            data = response.json()
+            response_cache.store(endpoint, response.headers, data)
+            return data
+        except httpx.HTTPStatusError as http_err:
+            print(f"HTTP error occurred: {http_err} - Status code: {http_err.response.status_code}")
+            raise ForecastError(f"NWS returned an error: {http_err}")
+        except httpx.TimeoutException as timeout_err:
+            print(f"Request timed out: {timeout_err}")
+            raise ForecastError("The request to NWS timed out.")
+        except httpx.HTTPError as req_err:
+            print(f"Request error: {req_err}")
+            raise ForecastError(f"An error occurred while making the request: {req_err}")
+
+async def gather_forecasts(locations, max_concurrency=ASYNC_MAX_CONCURRENCY):
+    '''
+    Fetches forecasts for many locations concurrently over one shared client
+
+    @param locations list of (location, units) tuples
+    @param max_concurrency max number of forecasts being worked on at once
+    @return list in the same order as locations, each entry is the get_forecast() tuple or the exception that location raised
+    '''
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with make_async_client() as client:
+        async def fetch_one(location, units):
+            async with semaphore:
+                return await AsyncDataFetcher(location, units, client).get_forecast()
+        return await asyncio.gather(*(fetch_one(location, units) for location, units in locations), return_exceptions=True)
+
+def fetch_forecasts(locations, max_concurrency=ASYNC_MAX_CONCURRENCY):
+    '''
+    Thin sync wrapper around gather_forecasts() for callers that are not running an event loop (the scheduler, scripts)
+
+    @param locations list of (location, units) tuples
+    @param max_concurrency max number of forecasts being worked on at once
+    @return list in the same order as locations, each entry is the get_forecast() tuple or the exception that location raised
+    '''
+    return asyncio.run(gather_forecasts(locations, max_concurrency))
+
+def get_forecast_sync(location, units):
+    '''
+    Sync wrapper for a single location, behaves like Data_Fetcher(location, units).get_forecast()
+
+    @param location users zipcode, city, address, etc...
+    @param units used to specify units when pulling from nws
+    @return forecast_discussion, organized_alerts, daily_forecasts, obs_data, hourly_forecast
+    '''
+    result = fetch_forecasts([(location, units)])[0]
+    if isinstance(result, BaseException):
+        raise result
+    return result
@@ -0,0 +1,169 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from backend.data_fetcher import Data_Fetcher, LocationError, ForecastError
+'''
+Plans the email batch around what the users share instead of around the users. Every due user is resolved to their forecast
+office, zone, grid cell, and closest station up front, then each unique product is fetched exactly once: the afd once per office,
+alerts once per zone & county, forecasts once per grid cell (and units), and observations once per station. The results are fanned back
+out into one job per user for the summarize -> render -> deliver pipeline, where summaries are shared per (afd, knowledge level)
+by the SummaryExecutor. Upstream calls per batch scale with distinct locations instead of with subscribers.
+'''
+PLANNER_WORKERS = int(os.getenv("BATCH_PLANNER_WORKERS", "8"))
+''' Locations resolved and products fetched at once while planning a batch'''
+
+# number of products every users email is built from: afd, alerts, daily forecast, hourly forecast, observations
+PRODUCTS_PER_USER = 5
+
+class BatchPlanner:
+    '''
+    BatchPlanner Class. Resolves a batch of users to their forecast cells, fetches every product they need once, and hands out
+    one job per user with the shared forecast data filled in.
+    '''
+    def __init__(self, users, workers=PLANNER_WORKERS):
+        '''
+        BatchPlanner object initialization method (constructor)
+
+        @param users list of User objects due an email
+        @param workers max number of locations resolved / products fetched at once
+        '''
+        self.users = users
+        self.workers = max(1, workers)
+        # location string -> point dictionary (office, gridX, gridY, zone_url, county_url, station), or the exception resolving it raised
+        self.points = {}
+        # product key -> product data, or the exception fetching it raised
+        self.products = {}
+
+    def run(self):
+        '''
+        Resolves every distinct location, then fetches every distinct product
+
+        @return self, so it can be created and run in one line
+        '''
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="planner") as pool:
+            locations = {user.location for user in self.users}
+            for location, point in zip(locations, pool.map(self.resolve, locations)):
+                self.points[location] = point
+
+            keys = {key for user in self.users for key in (self.product_keys(user) or {}).values()}
+            for key, product in zip(keys, pool.map(self.fetch, keys)):
+                self.products[key] = product
+        return self
+
+    def resolve(self, location):
+        '''
+        @param location a users location string
+        @return point dictionary with office, gridX, gridY, zone_url, county_url, and station (closest station feature), or the exception
+        '''
+        try:
+            df = Data_Fetcher(location, None)
+            coords = df.get_latlon()
+            if coords is None:
+                raise LocationError("Could not find location. Please try a different input.")
+            office, gridX, gridY, zone_url, station = df.get_forecast_office(coords[0], coords[1])
+            if not office:
+                raise ForecastError("Could not get forecast office info from NWS.")
+            # the station index has nothing to offer when the grids station list is empty, no obs means no email
+            if station is None:
+                raise ForecastError("No observation station found near that location.")
+            return {"office": office, "gridX": gridX, "gridY": gridY, "zone_url": zone_url, "county_url": df.county_url, "station": station}
+        except Exception as e:
+            return e
+
+    def product_keys(self, user):
+        '''
+        @param user User object
+        @return dictionary of product name -> product key for the users email, None if their location did not resolve
+        '''
+        point = self.points.get(user.location)
+        if point is None or isinstance(point, Exception):
+            return None
+        cell = (point["office"], point["gridX"], point["gridY"])
+        return {
+            "discussion": ("afd", point["office"]),
+            # zone and county together, warnings are issued for either
+            "alerts": ("alerts", point["zone_url"], point["county_url"]),
+            # forecasts come from the same grid cell store entry either way, but are converted per units
+            "daily": ("daily",) + cell + (user.units,),
+            "hourly": ("hourly",) + cell + (user.units,),
+            "obs": ("obs", point["station"]["properties"]["stationIdentifier"]),
+        }
+
+    def fetch(self, key):
+        '''
+        @param key product key from product_keys()
+        @return the product data, (text, issuance time) for an afd, or the exception fetching it raised
+        '''
+        try:
+            kind = key[0]
+            if kind == "afd":
+                df = Data_Fetcher(None, None)
+                discussion = df.get_discussion(key[1])
+                return discussion, df.afd_issuance_time
+            if kind == "alerts":
+                return Data_Fetcher(None, None).get_alerts(key[1], key[2])
+            if kind == "daily":
+                return Data_Fetcher(None, key[4]).get_daily_forecast(key[1], key[2], key[3])
+            if kind == "hourly":
+                return Data_Fetcher(None, key[4]).get_hourly_forecast(key[1], key[2], key[3])
+            if kind == "obs":
+                return Data_Fetcher(None, None).get_observations({"properties": {"stationIdentifier": key[1]}})
+            raise ValueError(f"Unknown product: {kind}")
+        except Exception as e:
+            return e
+
+    def jobs(self, on_error=None):
+        '''
+        Fans the fetched products back out to the users
+
+        @param on_error function called with (job, "fetch", exception) for a user whose location or products failed
+        @return generator of job dictionaries with the user and forecast, the same shape main.fetch_stage() builds
+        '''
+        for user in self.users:
+            job = {"user": user}
+            keys = self.product_keys(user)
+            if keys is None:
+                point = self.points.get(user.location)
+                if on_error is not None:
+                    on_error(job, "fetch", point)
+                continue
+
+            products = {name: self.products.get(key) for name, key in keys.items()}
+            # the first failure in email order wins, like get_forecast()
+            error = next((product for product in products.values() if isinstance(product, Exception)), None)
+            if error is not None:
+                if on_error is not None:
+                    on_error(job, "fetch", error)
+                continue
+
+            discussion, issuance_time = products["discussion"]
+            job["forecast"] = {
+                "discussion": discussion,
+                "alerts": products["alerts"],
+                "daily": products["daily"],
+                "obs": products["obs"],
+                "hourly": products["hourly"],
+                "office": self.points[user.location]["office"],
+                "issuance_time": issuance_time
+            }
+            yield job
+
+    def stats(self):
+        '''
+        @return dictionary with users, distinct locations, grid cells, offices, zones, stations, products the users needed,
+        products actually fetched, and the dedup ratio (needed / fetched)
+        '''
+        points = [point for point in self.points.values() if not isinstance(point, Exception)]
+        resolved = sum(1 for user in self.users if self.product_keys(user) is not None)
+        needed = resolved * PRODUCTS_PER_USER
+        fetched = len(self.products)
+        return {
+            "users": len(self.users),
+            "locations": len(self.points),
+            "cells": len({(p["office"], p["gridX"], p["gridY"]) for p in points}),
+            "offices": len({p["office"] for p in points}),
+            "zones": len({p["zone_url"] for p in points}),
+            "stations": len({p["station"]["properties"]["stationIdentifier"] for p in points}),
+            "needed": needed,
+            "fetched": fetched,
+            "dedup_ratio": round(needed / fetched, 2) if fetched else 0.0,
+        }
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from filelock import FileLock
+'''
+Small caching helpers shared by the backend. PersistentCache keeps a size bounded, expiring key/value store on disk so cached
+lookups (geocodes, nws metadata, etc...) survive app restarts and are shared between gunicorn workers. MemoryCache is the same
+idea without the disk, for things only worth keeping for the life of the process.
+'''
+CACHE_DIR = os.getenv("CACHE_DIR", "/mnt/data/cache")
+''' Directory the on-disk caches are written to, lives next to users.json on the server'''
+
+class PersistentCache:
+    '''
+    JSON file backed cache with a time to live on every entry and least-recently-used eviction once it holds max_entries.
+    Reads are served from memory, every write is merged with whatever other processes have written and saved atomically.
+    Keys must be strings and values must be json serializable.
+    '''
+    def __init__(self, path, ttl, max_entries):
+        '''
+        PersistentCache object initialization method (constructor)
+
+        @param path path to the json file backing the cache
+        @param ttl seconds an entry stays valid after it is stored
+        @param max_entries max number of entries kept, least recently used entries are dropped first
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # keys removed since the last save, so merging with the file on disk doesnt bring them back
+        self._deleted = set()
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        '''
+        Looks up a key, expired entries count as a miss and are dropped
+
+        @param key the cache key
+        @return the cached value or None if there is no valid entry
+        '''
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["stored"] > self.ttl:
+                del self._entries[key]
+                return None
+            # mark as most recently used
+            self._entries.move_to_end(key)
+            return entry["value"]
+
+    def set(self, key, value):
+        '''
+        Stores a value and writes the cache back to disk
+
+        @param key the cache key
+        @param value json serializable value to store
+        '''
+        with self._lock:
+            self._load()
+            self._entries[key] = {"value": value, "stored": time.time()}
+            self._entries.move_to_end(key)
+            self._deleted.discard(key)
+            self._evict()
+            self._save()
+
+    def delete(self, *keys):
+        '''
+        Removes keys from the cache if they are there, the file is only rewritten once no matter how many keys are given
+
+        @param keys the cache keys
+        '''
+        with self._lock:
+            self._load()
+            for key in keys:
+                self._entries.pop(key, None)
+                self._deleted.add(key)
+            self._save()
+
+    def keys(self):
+        '''
+        @return a list of every key currently in the cache, least recently used first
+        '''
+        with self._lock:
+            self._load()
+            return list(self._entries.keys())
+
+    def clear(self):
+        '''
+        Empties the cache, in memory and on disk
+        '''
+        with self._lock:
+            self._loaded = True
+            self._deleted.update(self._entries.keys())
+            self._entries.clear()
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with FileLock(self.path + ".lock"):
+                    self._write([])
+                self._deleted.clear()
+            except OSError as e:
+                print(f"Could not clear cache {self.path}: {e}")
+
+    def _load(self):
+        '''
+        Reads the cache file the first time the cache is used
+        '''
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with FileLock(self.path + ".lock"):
+                self._entries = OrderedDict(self._read())
+        except OSError as e:
+            print(f"Could not load cache {self.path}: {e}")
+
+    def _read(self):
+        '''
+        @return list of [key, entry] pairs stored in the cache file, least recently used first
+        '''
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cache file {self.path} is unreadable, starting fresh: {e}")
+            return []
+
+    def _evict(self):
+        '''
+        Drops expired entries and then the least recently used ones until the cache fits in max_entries
+        '''
+        now = time.time()
+        for key in [k for k, entry in self._entries.items() if now - entry["stored"] > self.ttl]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        '''
+        Merges in entries other processes have written since we loaded and writes the result back to disk
+        '''
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with FileLock(self.path + ".lock"):
+                merged = OrderedDict()
+                # entries only on disk are older news to us, so they go in the least recently used end
+                for key, entry in self._read():
+                    if key not in self._entries and key not in self._deleted:
+                        merged[key] = entry
+                merged.update(self._entries)
+                self._entries = merged
+                self._evict()
+                self._write(list(self._entries.items()))
+                self._deleted.clear()
+        except OSError as e:
+            # a cache that cant be written is still useful in memory, dont take the request down with it
+            print(f"Could not save cache {self.path}: {e}")
+
+    def _write(self, items):
+        '''
+        Atomically replaces the cache file so readers never see a half written file
+
+        @param items list of [key, entry] pairs to write
+        '''
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(items, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not write cache {self.path}: {e}")
+
+class MemoryCache:
+    '''
+    Thread safe in-memory cache with least-recently-used eviction once it holds max_entries, and an optional time to live.
+    Used for data that is only worth keeping for the life of the process.
+    '''
+    def __init__(self, max_entries, ttl=None):
+        '''
+        MemoryCache object initialization method (constructor)
+
+        @param max_entries max number of entries kept, least recently used entries are dropped first
+        @param ttl seconds an entry stays valid after it is stored, None to keep entries until they are evicted
+        '''
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        @param key the cache key
+        @return the cached value or None if there is no valid entry
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored = entry
+            if self.ttl is not None and time.time() - stored > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        '''
+        @param key the cache key
+        @param value value to store
+        '''
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        '''
+        @param key the cache key to remove
+        '''
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        ''' Empties the cache '''
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        '''
+        @return dictionary with the number of hits, misses, and entries currently held
+        '''
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
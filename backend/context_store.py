@@ -0,0 +1,52 @@
+import os
+import secrets
+from backend.cache import MemoryCache
+'''
+Server side store for the context an explanation needs (the afd, the summary shown to the user, and their expertise level). The
+summary routes register the context and hand the page a short id, so /explain-text only has to be sent the id and the selected
+text instead of the whole afd and summary every time.
+'''
+CONTEXT_TTL_SECONDS = int(os.getenv("CONTEXT_TTL_SECONDS", "3600"))
+''' Seconds a context is kept after it was last used'''
+CONTEXT_STORE_SIZE = int(os.getenv("CONTEXT_STORE_SIZE", "2000"))
+''' Max number of contexts kept, least recently used ones are dropped first'''
+
+class ContextStore:
+    '''
+    ContextStore Class. Bounded in-memory map of context id -> explanation context, entries expire once they have not been used
+    for the ttl.
+    '''
+    def __init__(self, ttl=CONTEXT_TTL_SECONDS, max_entries=CONTEXT_STORE_SIZE):
+        '''
+        ContextStore object initialization method (constructor)
+
+        @param ttl seconds a context is kept after it was last used
+        @param max_entries max number of contexts kept
+        '''
+        self._contexts = MemoryCache(max_entries, ttl=ttl)
+
+    def register(self, afd, summary, expertise, issuance_time = None):
+        '''
+        @param afd the full area forecast discussion the summary was made from
+        @param summary the summary text exactly as the user sees it
+        @param expertise the users weather knowledge level
+        @param issuance_time the afds issuanceTime from NWS, if known
+        @return the new context id, a short random url safe string
+        '''
+        context_id = secrets.token_urlsafe(12)
+        self._contexts.set(context_id, {"afd": afd, "summary": summary, "expertise": expertise, "issuance_time": issuance_time})
+        return context_id
+
+    def get(self, context_id):
+        '''
+        @param context_id id returned by register()
+        @return dictionary with afd, summary, expertise, and issuance_time, None if the id is unknown or expired
+        '''
+        context = self._contexts.get(context_id)
+        if context is not None:
+            # storing it again restarts the ttl, someone is still reading this summary
+            self._contexts.set(context_id, context)
+        return context
+
+# shared by the summary and explanation routes
+context_store = ContextStore()
@@ -1,17 +1,177 @@
-import requests
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 from requests.exceptions import HTTPError, Timeout, RequestException
+from backend.http_pool import http_get
+from backend.geocoder import geocode
+from backend.cache import PersistentCache, CACHE_DIR
+from backend.station_index import get_station_index
+from backend.http_cache import response_cache
+from backend.single_flight import SingleFlight
+from backend.alerts import alert_service, ugc_codes
+from backend.forecast_store import forecast_store
 
 BASE_URL = "https://api.weather.gov"
 ''' The base url for all nws api interactions'''
 USER_AGENT = "WeatherBearApp"
 ''' Username for interacting with NWS and openstreetmap API'''
+PRODUCT_WORKERS = int(os.getenv("NWS_PRODUCT_WORKERS", "8"))
+''' Max number of NWS product requests (afd, alerts, forecasts, obs) in flight at once across the whole process'''
+
+POINTS_CACHE_TTL = int(os.getenv("POINTS_CACHE_TTL", str(7 * 24 * 3600)))
+''' Seconds NWS /points metadata (office, grid, zone, station list) stays cached, 7 days by default'''
+POINTS_CACHE_SIZE = int(os.getenv("POINTS_CACHE_SIZE", "2000"))
+''' Max number of grid cells kept in the points metadata cache'''
+GRID_STEP = 0.0225
+''' Size of a NWS forecast grid cell (2.5 km) in degrees of latitude, used to bucket lat/lon for the points cache'''
+
+# shared by every Data_Fetcher so the total number of product requests stays bounded no matter how many forecasts run at once
+_product_pool = ThreadPoolExecutor(max_workers=PRODUCT_WORKERS, thread_name_prefix="nws-product")
+
+# coalesces identical nws requests that are in flight at the same time
+_request_flight = SingleFlight()
+
+_points_cache = PersistentCache(os.path.join(CACHE_DIR, "points.json"), POINTS_CACHE_TTL, POINTS_CACHE_SIZE)
+
+def points_cache_key(lat, lon):
+    '''
+    Quantizes a lat/lon to the NWS 2.5 km grid so nearby locations share one points cache entry
+
+    @param lat latitude
+    @param lon longitude
+    @return the grid cell key string
+    '''
+    return f"{round(float(lat) / GRID_STEP)}:{round(float(lon) / GRID_STEP)}"
+
+def cached_points_metadata(lat, lon):
+    '''
+    @param lat latitude
+    @param lon longitude
+    @return the cached /points metadata for the grid cell, None if it is not cached
+    '''
+    metadata = _points_cache.get(points_cache_key(lat, lon))
+    # entries cached before the county was kept miss the county alerts, look those cells up again
+    if metadata is not None and 'county_url' not in metadata:
+        return None
+    return metadata
+
+def store_points_metadata(lat, lon, metadata):
+    '''
+    Caches the /points metadata for a grid cell
+
+    @param lat latitude
+    @param lon longitude
+    @param metadata dictionary from build_points_metadata()
+    '''
+    # dont hang on to an empty station list, there would be no obs to show for the whole ttl
+    if metadata['stations']:
+        _points_cache.set(points_cache_key(lat, lon), metadata)
+
+def invalidate_points_metadata(lat=None, lon=None):
+    '''
+    Drops cached /points metadata, for a single location's grid cell or for everything if no location is given.
+    Use when NWS moves a station or re-draws a zone and the cached info goes stale.
+
+    @param lat latitude of the cell to drop, None to clear the whole cache
+    @param lon longitude of the cell to drop, None to clear the whole cache
+    '''
+    if lat is None or lon is None:
+        _points_cache.clear()
+    else:
+        _points_cache.delete(points_cache_key(lat, lon))
+
+def request_stats():
+    '''
+    Counters for the nws request coalescing, how many requests actually went out and how many callers piggybacked on one
+
+    @return dictionary with calls, coalesced, and in_flight counts
+    '''
+    return _request_flight.stats()
 
 ''' Location Exception that will bubble up if there is a location error '''
 class LocationError(Exception): pass
 ''' Forecast exception that will bubble up if there is a error getting forecast information '''
 class ForecastError(Exception): pass
 
+def parse_coordinates(location):
+    '''
+    Checks if a location string is already a "lat,lon" pair
+
+    @param location users zipcode, city, address, or "lat,lon"
+    @return (lat, lon) tuple if the location is a valid coordinate pair, None otherwise
+    '''
+    parts = location.split(",")
+    if len(parts) == 2:
+        lat_str = parts[0].strip()
+        lon_str = parts[1].strip()
+
+        try:
+            lat = float(lat_str)
+            lon = float(lon_str)
+
+            # Sanity Check
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return lat, lon
+        except ValueError:
+            pass  # Not a valid coordinate pair, fall through to geocoding
+    return None
+
+def build_points_metadata(data, obs_stations):
+    '''
+    Pulls the pieces of a NWS /points response and its observation station list that the forecast needs
+
+    @param data the /points json response
+    @param obs_stations the observation stations json response
+    @return dictionary with office, gridX, gridY, zone_url, county_url, stations_url, and stations (trimmed station features)
+    '''
+    # only keep what we use from each station, the full list is large and this gets written to disk
+    stations = [{
+        'properties': {
+            'stationIdentifier': station['properties']['stationIdentifier'],
+            'name': station['properties'].get('name'),
+        },
+        'geometry': {'coordinates': station['geometry']['coordinates'][:2]},
+    } for station in obs_stations['features']]
+
+    return {
+        'office': data['properties']['forecastOffice'][-3:],
+        'gridX': data['properties']['gridX'],
+        'gridY': data['properties']['gridY'],
+        'zone_url': data['properties']['forecastZone'],
+        'county_url': data['properties'].get('county'),
+        'stations_url': data['properties']['observationStations'],
+        'stations': stations,
+    }
+
+def parse_daily_forecast(forecast_data):
+    '''
+    Pulls the basic forecast info out of every period of a NWS gridpoint forecast response
+
+    @param forecast_data the gridpoint forecast json response
+    @return daily_forecasts list of dictionarys (1 dict for every forecast period) containing the basic daily forecast information 
+    '''
+    daily_forecasts = []
+
+    # Extract info
+    for period in forecast_data['properties']['periods']:
+        forecast = {
+            'name': period['name'],
+            'start_time': period['startTime'],
+            'end_time': period['endTime'],
+            'is_daytime': period['isDaytime'],
+            'temperature': period['temperature'],
+            'temperature_unit': period['temperatureUnit'],
+            'precipitation_chance': period['probabilityOfPrecipitation']['value'],
+            'wind_speed': period['windSpeed'],
+            'wind_direction': period['windDirection'],
+            'short_forecast': period['shortForecast'],
+            'detailed_forecast': period['detailedForecast'],
+            'icon': period['icon']
+        }
+        daily_forecasts.append(forecast)
+
+    return daily_forecasts
+
 class Data_Fetcher:
     '''
     Data_Fetcher Class. It handles all of the interactions with the NWS api and pulling data. Contains several
@@ -27,6 +187,11 @@ class Data_Fetcher:
         '''
         self.location = location
         self.units = units 
+        # filled in by get_forecast(), used to key cached summaries of the afd
+        self.forecast_office = None
+        self.afd_issuance_time = None
+        # filled in by get_forecast_office(), county coded warnings are looked up with it
+        self.county_url = None
 
     def get_forecast(self):
         '''
@@ -53,90 +218,100 @@ class Data_Fetcher:
             forecast_office, gridX, gridY, zone_url, obs_station = self.get_forecast_office(coords[0], coords[1])
             if not forecast_office:
                 raise ForecastError("Could not get forecast office info from NWS.")
+            self.forecast_office = forecast_office
         except Exception as e:
             print(f"Detailed ForecastError: {e}")  # You can replace with logging
             raise ForecastError("That location is likely outside the NWS coverage area or does not exist. Please try a different location in the U.S. May need to be more specific Ex: Raleigh, NC or Denver, CO")
 
-        # Get Text Forecast Discussion - May consider trimming this string at the start, save tokens passing into LLM $$$
+        # Every product below only depends on the office/grid/zone/station info, so pull them all at the same time
+        # instead of paying for five NWS round trips back to back
+        futures = [
+            _product_pool.submit(self.get_discussion, forecast_office),
+            _product_pool.submit(self.get_alerts, zone_url, self.county_url),
+            _product_pool.submit(self.get_daily_forecast, forecast_office, gridX, gridY),
+            _product_pool.submit(self.get_hourly_forecast, forecast_office, gridX, gridY),
+            _product_pool.submit(self.get_observations, obs_station),
+        ]
+        # results are collected in the same order the requests used to be made, so the first failure still wins
+        forecast_discussion, organized_alerts, daily_forecasts, hourly_forecast, obs_data = [f.result() for f in futures]
+
+        return forecast_discussion, organized_alerts, daily_forecasts, obs_data, hourly_forecast
+
+    def get_discussion(self, forecast_office):
+        '''
+        Pulls the latest area forecast discussion for the forecast office
+
+        @param forecast_office the three letter forecast office id
+        @return forecast_discussion string containing the most recent forecast discussion
+        '''
+        # Get Text Forecast Discussion - kept whole here since users can read the raw afd, the summarizer trims it down for the LLM
         text_url = f"{BASE_URL}/products/types/AFD/locations/{forecast_office}/latest"
         text_data = self.make_request(text_url, USER_AGENT)
         forecast_discussion = text_data['productText']
-        forecast_discussion_time = text_data['issuanceTime']
-
-        # Get Watches / Warnings
-        zone_id = zone_url[-6:]
-        watch_url = f"{BASE_URL}/alerts/active/zone/{zone_id}"
-        watch_data = self.make_request(watch_url, USER_AGENT)
-        alert_data = watch_data['features']
-
-        ## get all import info out of json
-        organized_alerts = []
-        for alert in alert_data:
-            prop = alert['properties']
-            params = prop.get('parameters', {})
-
-            # Grab most everything because not sure what we will need just yet
-            organized_alert = {
-                'event': prop.get('event'),
-                'sender_name': prop.get('senderName'),
-                'area': prop.get('areaDesc').split('; '),
-                'severity': prop.get('severity'),
-                'certainty': prop.get('certainty'),
-                'urgency': prop.get('urgency'),
-                'status': prop.get('status'),
-                'message_type': prop.get('messageType'),
-                'onset': prop.get('onset'),
-                'ends': prop.get('ends'),
-                'effective': prop.get('effective'),
-                'expires': prop.get('expires'),
-                'headline': prop.get('headline'),
-                'description': prop.get('description'),
-                'instruction': prop.get('instruction'),
-                'response': prop.get('response'),
-                'web': prop.get('web'),
-                'vtec': params.get('VTEC', [None])[0], 
-            }
-
-            
-            organized_alerts.append(organized_alert)
-        # Only care about alerts affecting our zone irl
-        organized_alerts = [a for a in organized_alerts if zone_id in alert['properties']['geocode']['UGC']]
+        # kept so summaries of this afd can be cached by office and issuance time
+        self.afd_issuance_time = text_data['issuanceTime']
+
+        return forecast_discussion
+
+    def get_alerts(self, zone_url, county_url=None):
+        '''
+        Pulls the active watches / warnings for the users forecast zone and county
 
+        @param zone_url the warning zone url from get_forecast_office()
+        @param county_url the county zone url from get_forecast_office() (self.county_url), warnings issued by county are missed without it
+        @return organized_alerts list of dictionarys (1 dict for every alert) containing info on active alerts in the area
+        '''
+        # Get Watches / Warnings, looked up in the national alert snapshot which is only downloaded once per refresh interval
+        zone_ids = ugc_codes(zone_url, county_url)
+        organized_alerts = alert_service.alerts_for_zones(zone_ids, lambda: self.make_request(f"{BASE_URL}/alerts/active", USER_AGENT))
+
+        return organized_alerts
+
+    def get_daily_forecast(self, forecast_office, gridX, gridY):
+        '''
+        Pulls the daily (12 hour period) forecast for the users grid point
+
+        @param forecast_office the three letter forecast office id
+        @param gridX stations x grid point
+        @param gridY stations y grid point
+        @return daily_forecasts list of dictionarys (1 dict for every forecast period) containing the basic daily forecast information 
+        '''
         # Get Forecasts
+        # Pulled thru the grid cell store, fetched once per cell in us units and converted here for metric users
         url = f"{BASE_URL}/gridpoints/{forecast_office}/{gridX},{gridY}/forecast"
-        url = self.check_units(url)        
-        forecast_data = self.make_request(url, USER_AGENT)
-        daily_forecasts = []
-
-        # Extract info
-        for period in forecast_data['properties']['periods']:
-            forecast = {
-                'name': period['name'],
-                'start_time': period['startTime'],
-                'end_time': period['endTime'],
-                'is_daytime': period['isDaytime'],
-                'temperature': period['temperature'],
-                'temperature_unit': period['temperatureUnit'],
-                'precipitation_chance': period['probabilityOfPrecipitation']['value'],
-                'wind_speed': period['windSpeed'],
-                'wind_direction': period['windDirection'],
-                'short_forecast': period['shortForecast'],
-                'detailed_forecast': period['detailedForecast'],
-                'icon': period['icon']
-            }
-            daily_forecasts.append(forecast)
+        forecast_data = forecast_store.get(url, self.units, lambda u: self.make_request(u, USER_AGENT))
+        daily_forecasts = parse_daily_forecast(forecast_data)
+
+        return daily_forecasts
+
+    def get_hourly_forecast(self, forecast_office, gridX, gridY):
+        '''
+        Pulls the hourly forecast for the users grid point
 
+        @param forecast_office the three letter forecast office id
+        @param gridX stations x grid point
+        @param gridY stations y grid point
+        @return hourly_forecast dictionary containing a list of periods with hourly forecast data (temp, dewpt, relative humidty, etc..)
+        '''
         # Get hourly forecasts
         url = f"{BASE_URL}/gridpoints/{forecast_office}/{gridX},{gridY}/forecast/hourly"
-        url = self.check_units(url)
-        hourly_forecast = self.make_request(url, USER_AGENT)
+        hourly_forecast = forecast_store.get(url, self.units, lambda u: self.make_request(u, USER_AGENT))
 
+        return hourly_forecast
+
+    def get_observations(self, obs_station):
+        '''
+        Pulls the latest observation from the closest station
+
+        @param obs_station the closest observation station feature from get_forecast_office()
+        @return obs_data dictionary containing information on the observations from the closest station. 
+        '''
         # Get closest observations
         obs_id = obs_station['properties']['stationIdentifier']
         url = f"{BASE_URL}/stations/{obs_id}/observations/latest"
         obs_data = self.make_request(url, USER_AGENT)
 
-        return forecast_discussion, organized_alerts, daily_forecasts, obs_data, hourly_forecast
+        return obs_data
         
 
     def get_latlon(self):
@@ -145,31 +320,17 @@ class Data_Fetcher:
 
         @return the station lat lon in a tuple --> data[0] = 'lat' data[1] = 'lon'
         '''
-        url = f"https://nominatim.openstreetmap.org/search?q={self.location}&format=json&limit=1&countrycodes=us"
-
         try:
-            parts = self.location.split(",")
-            if len(parts) == 2:
-                lat_str = parts[0].strip()
-                lon_str = parts[1].strip()
-
-                try:
-                    lat = float(lat_str)
-                    lon = float(lon_str)
-
-                    # Sanity Check
-                    if -90 <= lat <= 90 and -180 <= lon <= 180:
-                        return lat, lon
-                except ValueError:
-                    pass  # Not a valid coordinate pair, fall through to geocoding
-
-            # send a request to api
-            response = requests.get(url, headers={"User-Agent": "WeatherBearApp/1.0"}, timeout = 10)
-            response.raise_for_status()
-            data = response.json()
+            # lat/lon pairs (from the browsers geolocation) dont need geocoding
+            coords = parse_coordinates(self.location)
+            if coords:
+                return coords
+
+            # geocode the location, cached locations never hit the api
+            coords = geocode(self.location)
 
-            if data:
-                return float(data[0]['lat']), float(data[0]['lon'])
+            if coords:
+                return coords
             else:
                 raise LocationError("Could not find that location. Try a different location or a more specific name like 'Raleigh, NC'.")
         except(HTTPError, Timeout, RequestException) as e:
@@ -189,45 +350,89 @@ class Data_Fetcher:
         @return zone_url the warning zone
         @return closest_station the closest observation station
         '''
-        url = f"{BASE_URL}/points/{lat},{lon}"
-        data = self.make_request(url, USER_AGENT)
-       
+        metadata = self.get_points_metadata(lat, lon)
+
         # pull important station information
-        if data:
-            office = data['properties']['forecastOffice']
-            gridX = data['properties']['gridX']
-            gridY = data['properties']['gridY']
-            zone_url = data['properties']['forecastZone']
-            obs_stations = self.make_request(data['properties']['observationStations'], USER_AGENT)
-            office = office[-3:]
-            
-            closest_station = None
-            min_dist = math.inf
-            # find which obs station is closest to provided user location
-            for station in obs_stations['features']:
-                station_coords = station['geometry']['coordinates']
-                dist = self.haversine(lon, lat, station_coords[0], station_coords[1])
-                if dist < min_dist:
-                    min_dist = dist
-                    closest_station = station
+        if metadata:
+            office = metadata['office']
+            gridX = metadata['gridX']
+            gridY = metadata['gridY']
+            zone_url = metadata['zone_url']
+            self.county_url = metadata.get('county_url')
+
+            # find which obs station is closest to provided user location, the index is built once per station list
+            index = get_station_index(metadata['stations_url'], metadata['stations'])
+            closest_station = index.nearest(lat, lon)
 
             return office, gridX, gridY, zone_url, closest_station
         else:
             print("Failed to Retrieve Data")
 
-        
+    def get_points_metadata(self, lat, lon):
+        '''
+        Gets the NWS /points metadata (office, grid points, zone, and observation station list) for a location. This almost never 
+        changes so it is cached by grid cell, repeat lookups for the same area skip both the /points and the station list requests
+
+        @param lat latitude of user
+        @param lon longitude of user
+        @return dictionary with office, gridX, gridY, zone_url, stations_url, and stations (trimmed station features), None on failure
+        '''
+        metadata = cached_points_metadata(lat, lon)
+        if metadata is not None:
+            return metadata
+
+        url = f"{BASE_URL}/points/{lat},{lon}"
+        data = self.make_request(url, USER_AGENT)
+        if not data:
+            return None
+
+        stations_url = data['properties']['observationStations']
+        obs_stations = self.make_request(stations_url, USER_AGENT)
+
+        metadata = build_points_metadata(data, obs_stations)
+        store_points_metadata(lat, lon, metadata)
+        return metadata
+
     def make_request(self, endpoint, user_agent):
         '''
-        Helper function that makes api requests to NWS API
+        Helper function that makes api requests to NWS API. Responses are cached following the NWS cache headers, a fresh
+        cached response skips the network and a stale one is revalidated so an unchanged product comes back as a cheap 304.
+        Concurrent requests for the same url are coalesced into one.
 
         @param endpoint the url of api at desired point
         @param user_agent a username that is used when calling api, private stored in .env
+        @return the parsed json response, shared with the cache so it should not be modified
+        '''
+        cached = response_cache.fresh(endpoint)
+        if cached is not None:
+            return cached
+
+        # if another thread is already pulling this url, wait for it and share the response instead of asking nws twice
+        return _request_flight.do(endpoint, self._fetch, endpoint, user_agent)
+
+    def _fetch(self, endpoint, user_agent):
+        '''
+        Does the actual network request for make_request(), revalidating a stale cached response if there is one
+
+        @param endpoint the url of api at desired point
+        @param user_agent a username that is used when calling api
+        @return the parsed json response
         '''
         headers = {"User-Agent": user_agent}
+        headers.update(response_cache.validators(endpoint))
         try:
-            response = requests.get(endpoint, headers=headers, timeout=15)
+            response = http_get(endpoint, headers=headers)
             response.raise_for_status()
-            return response.json()
+            if response.status_code == 304:
+                cached = response_cache.revalidated(endpoint, response.headers)
+                if cached is not None:
+                    return cached
+                # cached copy was evicted while we were waiting, ask again for the full response
+                response = http_get(endpoint, headers={"User-Agent": user_agent})
+                response.raise_for_status()
+            data = response.json()
+            response_cache.store(endpoint, response.headers, data)
+            return data
         except HTTPError as http_err:
             print(f"HTTP error occurred: {http_err} - Status code: {response.status_code}")
             raise ForecastError(f"NWS returned an error: {http_err}")
@@ -256,15 +461,3 @@ class Data_Fetcher:
         c = 2 * math.asin(math.sqrt(a))
         r = 6371
         return c * r
-    
-    def check_units(self, url):
-        ''' 
-        Checks units preference and pulls si units if necessary.
-        
-        @param the url of the api request link
-        '''
-        if self.units == "metric":
-            # string added onto api link that modifys what units the data is pulled in
-            url += "?units=si"
-
-        return url
\ No newline at end of file
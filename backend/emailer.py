@@ -1,11 +1,129 @@
-import smtplib
 import os
+import json
+import hashlib
 from email.message import EmailMessage
 from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader
+from backend.outbox import outbox
+from backend.cache import MemoryCache
 
 # load the env file
 load_dotenv()
 
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+''' The apps template folder, the email templates live in templates/email'''
+EMAIL_BODY_CACHE_SIZE = int(os.getenv("EMAIL_BODY_CACHE_SIZE", "500"))
+''' Max number of rendered email bodies kept, one per unique forecast / units / summary combination'''
+
+# plain text email, nothing to escape. Loaded and compiled once at import instead of per email
+_template_env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=False, trim_blocks=True)
+_body_template = _template_env.get_template("email/forecast.txt")
+
+# rendered bodies by content key, users sharing a grid cell, station, units, and knowledge level get the same body
+_body_cache = MemoryCache(EMAIL_BODY_CACHE_SIZE)
+
+# observation fields the email uses
+OBS_FIELDS = ["temperature", "dewpoint", "windChill", "heatIndex", "precipitationLastHour", "precipitationLast6Hours"]
+
+def body_key(obs, forecast, warnings, afd, units):
+    '''
+    @param obs observation dictionary from Data_Fetcher
+    @param forecast list of daily forecast period dictionaries
+    @param warnings list of alert dictionaries
+    @param afd the summarized forecast discussion
+    @param units the users units preference
+    @return key that is the same for every email body that would render the same
+    '''
+    properties = obs['properties']
+    content = [
+        units,
+        [properties[field]['value'] for field in OBS_FIELDS],
+        properties['stationName'],
+        properties['textDescription'],
+        [(period['name'], period['detailed_forecast']) for period in forecast[:2]],
+        [(alert['headline'], alert.get('description')) for alert in warnings],
+        afd,
+    ]
+    return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+def to_fahrenheit(value):
+    '''
+    @param value temperature in celsius, or None
+    @return the temperature in fahrenheit rounded to a whole degree, None stays None
+    '''
+    return None if value is None else round((value * (9/5)) + 32)
+
+def to_inches(value):
+    '''
+    @param value precipitation in mm, or None
+    @return the precipitation in inches rounded, None stays None
+    '''
+    return None if value is None else round(value / 25.4)
+
+def body_context(obs, forecast, warnings, afd, units):
+    '''
+    Builds the variables the email body template is rendered with
+
+    @param obs observation dictionary from Data_Fetcher
+    @param forecast list of daily forecast period dictionaries
+    @param warnings list of alert dictionaries
+    @param afd the summarized forecast discussion
+    @param units the users units preference
+    @return dictionary of template variables
+    '''
+    ## observations dont have a unit modifier, they always come in celsius and mm unlike the forecast
+    properties = obs['properties']
+    values = {field: properties[field]['value'] for field in OBS_FIELDS}
+    if units == "imperial":
+        unit = "F"
+        for field in ["temperature", "dewpoint", "windChill", "heatIndex"]:
+            values[field] = to_fahrenheit(values[field])
+        for field in ["precipitationLastHour", "precipitationLast6Hours"]:
+            values[field] = to_inches(values[field])
+    else:
+        unit = "C"
+
+    # heat index wins over wind chill when both are reported
+    feels_like = values["heatIndex"] if values["heatIndex"] is not None else values["windChill"]
+
+    return {
+        "unit": unit,
+        "temperature": values["temperature"],
+        "dewpoint": values["dewpoint"],
+        "feels_like": feels_like,
+        "station": properties['stationName'],
+        "clouds": properties['textDescription'],
+        "last_hour_precip": values["precipitationLastHour"],
+        "last_6_hour_precip": values["precipitationLast6Hours"],
+        "periods": forecast[:2],
+        "warnings": warnings,
+        "afd": afd,
+    }
+
+def render_body(obs, forecast, warnings, afd, units):
+    '''
+    Renders the email body (everything after the greeting), or reuses the one already rendered for the same content
+
+    @param obs observation dictionary from Data_Fetcher
+    @param forecast list of daily forecast period dictionaries
+    @param warnings list of alert dictionaries
+    @param afd the summarized forecast discussion
+    @param units the users units preference
+    @return the email body string
+    '''
+    key = body_key(obs, forecast, warnings, afd, units)
+    body = _body_cache.get(key)
+    if body is None:
+        body = _body_template.render(body_context(obs, forecast, warnings, afd, units))
+        _body_cache.set(key, body)
+    return body
+
+def body_cache_stats():
+    '''
+    @return dictionary with the rendered body cache hits, misses, and size
+    '''
+    return _body_cache.stats()
+
 class Emailer:
     '''
     Emailer class. Contains methods that handle building the email string and sending the email to users. Interacts with main.py to run
@@ -32,88 +150,14 @@ class Emailer:
         Handles building the email string that will be sent to users. 
         Example emails can be found at weatherbear.org/emailbot
         '''
-        email_string = f"Hello {self.User.name}, "
-
-        ## Get obs from self and account for units because observations dont have a unit modifier, always come in celsius unlike forecast.
-        if self.User.preferences["units"] == "imperial":
-            temp_unit = "F"
-            # observation temperatures & dewpoints are in celcius - must convert to F
-            temperature = self.obs['properties']['temperature']['value']
-            if temperature is not None:
-                temperature = round((temperature * (9/5)) + 32)
-            dewpoint = self.obs['properties']['dewpoint']['value']
-            if dewpoint is not None:
-                dewpoint = round((dewpoint * (9/5)) + 32)
-            windChill = self.obs['properties']['windChill']['value']
-            if windChill is not None:
-                windChill = round((windChill * (9/5)) + 32)
-            heatIndex = self.obs['properties']['heatIndex']['value']
-            if heatIndex is not None:
-                heatIndex = round((heatIndex * (9/5)) + 32)
-            station = self.obs['properties']['stationName']
-            clouds = self.obs['properties']['textDescription']
-            #precip in mm, should convert to inches for imperial
-            lastHourPrecip = self.obs['properties']['precipitationLastHour']['value']
-            if lastHourPrecip is not None:
-                lastHourPrecip = round(lastHourPrecip / 25.4)
-            last6HourPrecip = self.obs['properties']['precipitationLast6Hours']['value']
-            if last6HourPrecip is not None:
-                last6HourPrecip = round(last6HourPrecip / 25.4)
-        else:
-            temp_unit = "C"
-            temperature = self.obs['properties']['temperature']['value']
-            dewpoint = self.obs['properties']['dewpoint']['value']
-            windChill = self.obs['properties']['windChill']['value']
-            heatIndex = self.obs['properties']['heatIndex']['value']
-            station = self.obs['properties']['stationName']
-            clouds = self.obs['properties']['textDescription']
-            lastHourPrecip = self.obs['properties']['precipitationLastHour']['value']
-            last6HourPrecip = self.obs['properties']['precipitationLast6Hours']['value']
-
-        # Observation string 
-        if heatIndex is not None:
-            email_string += f"it is currently {temperature} degrees {temp_unit} with a dewpoint of {dewpoint} {temp_unit}, for a feels-like temperature of {heatIndex} {temp_unit} at {station} with {clouds.lower()} skies. "
-        elif windChill is not None:
-            email_string += f"it is currently {temperature} degrees {temp_unit} with a dewpoint of {dewpoint} {temp_unit}, for a feels-like temperature of {windChill} {temp_unit} at {station} with {clouds.lower()} skies. "
-        else:
-            email_string += f"it is currently {temperature} degrees {temp_unit} with a dewpoint of {dewpoint} {temp_unit} at {station} with {clouds} skies. "
-
-        # precip sentence only if necessary
-        if lastHourPrecip is not None:
-            email_string += f"There has been {lastHourPrecip} of precipitation in the past hour, and {last6HourPrecip} in the past 6 hours.\n"
-        else:
-            email_string += "\n\n"
-
-        # Forecast strings
-        email_string += "Today's Forecast:\n"
-
-        email_string += self.forecast[0]['name'] + ": " + self.forecast[0]['detailed_forecast'] + "\n\n"
-        email_string += self.forecast[1]['name'] + ": " + self.forecast[1]['detailed_forecast'] + "\n"
-
-        # Only list watches and warnings if they exist for the area at the time
-        if len(self.warnings) != 0:
-            email_string = email_string + "\n" + "Watches/Warnings in your area:\n\n"
-            for alert in self.warnings:
-                email_string += alert['headline'] + "\n"
-                if "Special Weather Statement" in alert['headline']:
-                    email_string += ": " + alert['description'] + "\n"
-                else:
-                    email_string += "\n"
-            
-        # add summarized afd
-        email_string += "\nSummarized forecast discussion: \n\n"
-        email_string += self.afd
-
-        email_string += "\n\nStay weather aware!\n- WeatherBear 🐻"
-
-        #unsubscribe link
-        email_string += "\n\n\nNo longer want forecasts? Unsubscribe at https://weatherbear.org/emailbot"
-
-        return email_string
+        # only the greeting is per user, the body is shared by everyone with the same forecast, units, and summary
+        return f"Hello {self.User.name}, " + render_body(self.obs, self.forecast, self.warnings, self.afd, self.User.preferences["units"])
 
-    def send_email(self):
-        ''' 
-        Handles sending the email 
+    def build_message(self):
+        '''
+        Builds the email message that will be sent to the user
+
+        @return EmailMessage with the subject, addresses, and body filled in
         '''
         email_body = self.generate_email()
         email_subject = f"🌦️ Daily Weather Update, {self.User.name}"
@@ -123,12 +167,16 @@ class Emailer:
         message['From'] = "weatherbear.emailbot@gmail.com"
         message['To'] = self.User.email
         message.set_content(email_body)
+        return message
+
+    def send_email(self):
+        ''' 
+        Handles sending the email, queued in the outbox and delivered (with retries) by the outbox delivery job
+        '''
+        message = self.build_message()
 
         try:
-            with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-                smtp.starttls()
-                smtp.login(os.getenv("SENDER_EMAIL"), os.getenv("EMAIL_APP_PASSWORD"))
-                smtp.send_message(message)
-                print(f"Email send to {self.User.name} - {self.User.email}")
+            outbox.enqueue(message)
+            print(f"Email queued for {self.User.name} - {self.User.email}")
         except Exception as e:
-            print(f"Failed to send: {e}")
\ No newline at end of file
+            print(f"Failed to queue: {e}")
@@ -0,0 +1,64 @@
+import os
+import re
+import hashlib
+from backend.cache import MemoryCache
+'''
+Cache of LLM explanations. People reading the same summary tend to highlight the same phrases ("shortwave", "CAPE", "marine
+layer"), so explanations are remembered by (afd, summary, selected text, knowledge level) and a repeat selection is answered
+without another LLM call. Users can still ask for a fresh explanation, which replaces the cached one.
+'''
+EXPLANATION_CACHE_TTL = int(os.getenv("EXPLANATION_CACHE_TTL", str(6 * 3600)))
+''' Seconds an explanation is reused for, afds are reissued every few hours so there is no point keeping them much longer'''
+EXPLANATION_CACHE_SIZE = int(os.getenv("EXPLANATION_CACHE_SIZE", "2000"))
+''' Max number of explanations kept'''
+
+_explanation_cache = MemoryCache(EXPLANATION_CACHE_SIZE, ttl=EXPLANATION_CACHE_TTL)
+
+def normalize_selection(selected_text):
+    '''
+    Makes selections that only differ by case, spacing, or the punctuation dragged along at the edges match
+
+    @param selected_text the text the user highlighted
+    @return normalized selection, "  Marine Layer, " -> "marine layer"
+    '''
+    text = re.sub(r"\s+", " ", selected_text.casefold())
+    return text.strip(" .,;:!?\"'()[]")
+
+def explanation_key(afd_id, summary, selected_text, weather_knowledge):
+    '''
+    @param afd_id something that identifies the afd, its issuance time when known
+    @param summary the summary the text was selected from
+    @param selected_text the text the user highlighted
+    @param weather_knowledge the users weather knowledge level
+    @return sha256 hex digest used as the cache key
+    '''
+    parts = [afd_id, summary, normalize_selection(selected_text), weather_knowledge]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+def afd_identity(afd, issuance_time=None):
+    '''
+    @param afd the area forecast discussion text
+    @param issuance_time the afds issuanceTime from NWS, if known
+    @return the issuance time, or a hash of the afd text when it is not known
+    '''
+    return issuance_time or hashlib.sha256(afd.encode("utf-8")).hexdigest()
+
+def get_explanation(key):
+    '''
+    @param key key from explanation_key()
+    @return the cached explanation, None if there is none
+    '''
+    return _explanation_cache.get(key)
+
+def store_explanation(key, explanation):
+    '''
+    @param key key from explanation_key()
+    @param explanation the explanation text from the LLM
+    '''
+    _explanation_cache.set(key, explanation)
+
+def explanation_stats():
+    '''
+    @return dictionary with the explanation cache hits, misses, and size
+    '''
+    return _explanation_cache.stats()
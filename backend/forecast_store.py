@@ -0,0 +1,243 @@
+import os
+import re
+import copy
+import threading
+from backend.cache import MemoryCache
+'''
+Grid-cell forecast store. Every user in the same NWS grid cell gets the same daily and hourly forecast, so each cell is fetched once
+per freshness window in NWS's default (us customary) units and converted to metric locally when a metric user asks for it. Before
+this, metric and imperial users in the same cell downloaded the same forecast twice.
+'''
+FORECAST_FRESH_SECONDS = int(os.getenv("FORECAST_FRESH_SECONDS", "600"))
+''' Seconds a grid cells forecast is reused before it is fetched again'''
+FORECAST_STORE_SIZE = int(os.getenv("FORECAST_STORE_SIZE", "512"))
+''' Max number of grid cells (per unit system) kept in the store'''
+
+# "8 to 12 mph", "23 mph"
+_SPEED_RE = re.compile(r"(\d+)(\s+to\s+)(\d+)\s*mph|(\d+)\s*mph")
+# pieces of the temperature phrases in NWS forecast text
+_NUM = r"-?\d+(?:\s+(?:below|above)(?:\s+zero)?)?|zero"
+_QUALIFIER = r"lower|low|mid|middle|upper|high"
+_SPAN = rf"(?:(?:{_QUALIFIER})(?:\s+to\s+(?:{_QUALIFIER}))?\s+)?(?:\d0s|teens|single\s+digits)"
+# a number followed by one of these is not a temperature: a decimal ("0.1 inches"), or a speed, percent, precipitation, snow level,
+# visibility, or wave height unit
+_NOT_TEMP = r"(?!\.\d|\s*(?:mph|km/h|kt\b|knots?\b|percent|%|inch|inches|in\.|feet|foot|ft\b|miles?\b|mi\b|km\b|cm\b|mm\b|meters?\b|m\b))"
+# every way a temperature is written in the forecast text, matched in one pass so converted values are never converted again:
+#   "highs in the mid 90s", "lows in the upper 50s to lower 60s", "in the teens", "in the single digits"
+#   "highs 85 to 90", "heat index values 100 to 105", "lows from 5 below to 5 above"
+#   "highs 85", "lows 5 below zero"
+#   "high near 96", "around zero", "heat index values as high as 103"
+_TEMP_RE = re.compile(
+    rf"\bin\s+the\s+(?P<span>{_SPAN})(?:\s+to\s+(?:the\s+)?(?P<span_to>{_SPAN}))?\b"
+    rf"|\b(?P<range_word>highs?|lows?|temperatures?|values)(?P<range_sep>\s+(?:from\s+)?)(?P<low>{_NUM})(?P<to>\s+to\s+)(?P<high>{_NUM})\b{_NOT_TEMP}"
+    rf"|\b(?P<word>highs?|lows?)(?P<word_sep>\s+)(?P<value>{_NUM})\b(?!\s+to\s){_NOT_TEMP}"
+    rf"|\b(?P<prep>near|around|as high as|as low as)(?P<prep_sep>\s+)(?P<prep_value>{_NUM})\b{_NOT_TEMP}",
+    re.IGNORECASE)
+
+# where in a decade each qualifier falls, "upper 30s" is 36 to 39
+_QUALIFIER_RANGE = {"lower": (0, 3), "low": (0, 3), "mid": (3, 6), "middle": (3, 6), "upper": (6, 9), "high": (6, 9)}
+
+def f_to_c(value):
+    '''
+    @param value temperature in fahrenheit
+    @return temperature in celsius rounded to a whole degree
+    '''
+    return round((value - 32) * 5 / 9)
+
+def mph_to_kmh(value):
+    '''
+    @param value speed in miles per hour
+    @return speed in km/h rounded to a whole number
+    '''
+    return round(value * 1.609344)
+
+def convert_wind_speed(text):
+    '''
+    @param text NWS wind speed string like "8 to 12 mph"
+    @return the same string in km/h, "13 to 19 km/h"
+    '''
+    def replace(match):
+        if match.group(4) is not None:
+            return f"{mph_to_kmh(int(match.group(4)))} km/h"
+        return f"{mph_to_kmh(int(match.group(1)))}{match.group(2)}{mph_to_kmh(int(match.group(3)))} km/h"
+    return _SPEED_RE.sub(replace, text) if text else text
+
+def parse_temperature(text):
+    '''
+    @param text a temperature as written in forecast text, "96", "-5", "5 below", "10 below zero", "5 above zero", or "zero"
+    @return the temperature as an int
+    '''
+    text = text.lower()
+    if text == "zero":
+        return 0
+    value = int(text.split()[0])
+    return -value if "below" in text else value
+
+def span_range(span):
+    '''
+    @param span a decade phrase from forecast text, "90s", "mid 90s", "mid to upper 70s", "lower teens", "single digits"
+    @return (low, high) fahrenheit range the phrase covers
+    '''
+    words = span.lower().split()
+    if words[-1] == "teens":
+        base = 10
+    elif words[-1] == "digits":
+        base = 0
+        words = words[:-1]
+    else:
+        base = int(words[-1][:-1])
+    qualifiers = [word for word in words[:-1] if word in _QUALIFIER_RANGE]
+    if not qualifiers:
+        return base, base + 9
+    return base + _QUALIFIER_RANGE[qualifiers[0]][0], base + _QUALIFIER_RANGE[qualifiers[-1]][1]
+
+def convert_span(span, span_to=None):
+    '''
+    @param span decade phrase, "mid 90s"
+    @param span_to second decade phrase of "upper 50s to lower 60s", None if there is only one
+    @return the phrase in celsius, "around 35" when the range is narrow, "from 32 to 37" otherwise
+    '''
+    low, high = span_range(span)
+    if span_to is not None:
+        high = span_range(span_to)[1]
+    low_c, high_c = f_to_c(low), f_to_c(high)
+    if high_c - low_c <= 2:
+        return f"around {f_to_c((low + high) / 2)}"
+    return f"from {low_c} to {high_c}"
+
+def convert_temperature_phrase(match):
+    '''
+    @param match a _TEMP_RE match
+    @return the matched temperature phrase in celsius
+    '''
+    if match.group("span") is not None:
+        return convert_span(match.group("span"), match.group("span_to"))
+    if match.group("range_word") is not None:
+        low, high = parse_temperature(match.group("low")), parse_temperature(match.group("high"))
+        # "lows 20 to 25 below zero", the below belongs to both ends
+        if "below" in match.group("high").lower() and match.group("low").isdigit():
+            low = -low
+        low, high = f_to_c(low), f_to_c(high)
+        return f"{match.group('range_word')}{match.group('range_sep')}{low}{match.group('to')}{high}"
+    if match.group("word") is not None:
+        return f"{match.group('word')}{match.group('word_sep')}{f_to_c(parse_temperature(match.group('value')))}"
+    return f"{match.group('prep')}{match.group('prep_sep')}{f_to_c(parse_temperature(match.group('prep_value')))}"
+
+def convert_forecast_text(text):
+    '''
+    Converts the temperatures and wind speeds written out in a NWS detailed forecast to metric
+
+    @param text detailed forecast like "Sunny, with a high near 96. Southwest wind 8 to 12 mph."
+    @return the same text with metric values, "Sunny, with a high near 36. Southwest wind 13 to 19 km/h."
+    '''
+    if not text:
+        return text
+    text = convert_wind_speed(text)
+    return _TEMP_RE.sub(convert_temperature_phrase, text)
+
+def convert_period(period):
+    '''
+    Converts one forecast period (daily or hourly) from NWS us units to si units in place
+
+    @param period forecast period dictionary from the NWS gridpoint forecast
+    '''
+    if period.get('temperatureUnit') == "F" and period.get('temperature') is not None:
+        temperature = period['temperature']
+        # some offices send temperature as a quantitative value instead of a number
+        if isinstance(temperature, dict):
+            if temperature.get('value') is not None:
+                temperature['value'] = f_to_c(temperature['value'])
+                temperature['unitCode'] = "wmoUnit:degC"
+        else:
+            period['temperature'] = f_to_c(temperature)
+        period['temperatureUnit'] = "C"
+    if period.get('windSpeed'):
+        period['windSpeed'] = convert_wind_speed(period['windSpeed'])
+    if period.get('windGust'):
+        period['windGust'] = convert_wind_speed(period['windGust'])
+    if period.get('detailedForecast'):
+        period['detailedForecast'] = convert_forecast_text(period['detailedForecast'])
+
+def to_metric(forecast_data):
+    '''
+    @param forecast_data NWS gridpoint forecast (daily or hourly) json in us units
+    @return a converted copy of the forecast in si units, the original is left alone
+    '''
+    converted = copy.deepcopy(forecast_data)
+    for period in converted['properties']['periods']:
+        convert_period(period)
+    return converted
+
+class GridForecastStore:
+    '''
+    GridForecastStore Class. Holds the daily and hourly forecast json for each grid cell, fetched in us units, plus the metric
+    conversions made from them. Forecasts handed out are shared between callers so they should be treated as read only.
+    '''
+    def __init__(self, fresh_seconds=FORECAST_FRESH_SECONDS, max_entries=FORECAST_STORE_SIZE):
+        '''
+        GridForecastStore object initialization method (constructor)
+
+        @param fresh_seconds seconds a cells forecast is reused before it is fetched again
+        @param max_entries max number of forecasts kept per unit system
+        '''
+        self.fresh_seconds = fresh_seconds
+        self._canonical = MemoryCache(max_entries, ttl=fresh_seconds)
+        self._converted = MemoryCache(max_entries, ttl=fresh_seconds)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def get(self, url, units, fetch=None):
+        '''
+        Gets a grid cell forecast in the users units
+
+        @param url the gridpoint forecast url without a units parameter (.../forecast or .../forecast/hourly)
+        @param units "imperial" or "metric"
+        @param fetch function that takes the url and returns the json, used when the cell is not in the store
+        @return the forecast json in the requested units, None if it is not stored and no fetch was given
+        '''
+        forecast_data = self._canonical.get(url)
+        if forecast_data is None:
+            if fetch is None:
+                return None
+            # one fetch per cell, anyone else asking for the same cell waits for it
+            with self._lock_for(url):
+                forecast_data = self._canonical.get(url)
+                if forecast_data is None:
+                    forecast_data = fetch(url)
+                    self.put(url, forecast_data)
+
+        if units != "metric":
+            return forecast_data
+
+        # conversions remember which forecast they came from so a refreshed cell never hands out an old conversion
+        cached = self._converted.get(url)
+        if cached is not None and cached[0] is forecast_data:
+            return cached[1]
+        converted = to_metric(forecast_data)
+        self._converted.set(url, (forecast_data, converted))
+        return converted
+
+    def put(self, url, forecast_data):
+        '''
+        Stores a freshly fetched forecast for a cell, dropping any conversion of the old one
+
+        @param url the gridpoint forecast url without a units parameter
+        @param forecast_data the forecast json in us units
+        '''
+        self._canonical.set(url, forecast_data)
+        self._converted.delete(url)
+
+    def _lock_for(self, url):
+        '''
+        @param url the gridpoint forecast url
+        @return the lock used while fetching that cell
+        '''
+        with self._locks_lock:
+            lock = self._locks.get(url)
+            if lock is None:
+                # only ever holds one lock per cell we have fetched, small enough to never bother trimming
+                lock = self._locks[url] = threading.Lock()
+            return lock
+
+# shared by the web routes and the email batch
+forecast_store = GridForecastStore()
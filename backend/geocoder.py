@@ -0,0 +1,83 @@
+import os
+import re
+from backend.cache import PersistentCache, CACHE_DIR
+from backend.http_pool import http_get
+'''
+Geocoding for WeatherBear. Turns free text locations (zipcodes, cities, addresses) into lat/lon using the OpenStreetMap Nominatim api.
+Results are kept in a persistent cache so a users unchanging location is only looked up once instead of on every email and
+every forecast, which also keeps us well under Nominatim's 1 request per second usage policy.
+'''
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+''' The url for openstreetmap geocoding searches'''
+GEOCODE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+''' Seconds a geocoded location stays cached, 30 days by default'''
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "5000"))
+''' Max number of locations kept in the geocode cache'''
+
+_geocode_cache = PersistentCache(os.path.join(CACHE_DIR, "geocode.json"), GEOCODE_TTL, GEOCODE_CACHE_SIZE)
+
+def normalize_query(location):
+    '''
+    Folds case, punctuation and whitespace so "Raleigh, NC" and "raleigh nc " share a cache entry
+
+    @param location free text location
+    @return the normalized cache key
+    '''
+    folded = re.sub(r"[^\w\s]", " ", location.lower())
+    return " ".join(folded.split())
+
+def cached_geocode(location):
+    '''
+    @param location free text location
+    @return cached (lat, lon) tuple for the location, None if it has not been looked up (or the entry expired)
+    '''
+    cached = _geocode_cache.get(normalize_query(location))
+    if cached is not None:
+        return cached[0], cached[1]
+    return None
+
+def remember_geocode(location, coords):
+    '''
+    Saves a geocoded location to the cache
+
+    @param location free text location
+    @param coords (lat, lon) tuple
+    '''
+    _geocode_cache.set(normalize_query(location), list(coords))
+
+def nominatim_params(location):
+    '''
+    @param location free text location
+    @return query parameters for a Nominatim search of the location, limited to the US since we only cover NWS areas
+    '''
+    return {"q": location, "format": "json", "limit": 1, "countrycodes": "us"}
+
+def parse_nominatim(data):
+    '''
+    @param data Nominatim search json response
+    @return (lat, lon) tuple of the best match, None if nothing matched
+    '''
+    if not data:
+        return None
+    return float(data[0]['lat']), float(data[0]['lon'])
+
+def geocode(location):
+    '''
+    Gets the lat/lon of a free text location, checking the cache before calling Nominatim
+
+    @param location users zipcode, city, address, etc...
+    @return (lat, lon) tuple, or None if Nominatim could not find the location
+    @raise requests exceptions (HTTPError, Timeout, RequestException) if the api call fails
+    '''
+    coords = cached_geocode(location)
+    if coords is not None:
+        return coords
+
+    # send a request to api
+    response = http_get(NOMINATIM_URL, params=nominatim_params(location), headers={"User-Agent": "WeatherBearApp/1.0"}, timeout=10)
+    response.raise_for_status()
+    coords = parse_nominatim(response.json())
+
+    if coords is not None:
+        remember_geocode(location, coords)
+    return coords
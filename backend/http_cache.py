@@ -0,0 +1,139 @@
+import os
+import time
+from email.utils import parsedate_to_datetime
+from backend.cache import MemoryCache
+'''
+HTTP response cache for the NWS api. NWS products (afds, gridpoint forecasts, observations, etc...) come back with Cache-Control,
+Expires, ETag and Last-Modified headers. ResponseCache follows them: fresh responses are served without touching the network and
+stale ones are revalidated with If-None-Match / If-Modified-Since so an unchanged product costs an empty 304 instead of the full json.
+'''
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+''' Max number of NWS responses kept in memory'''
+
+def freshness_lifetime(headers):
+    '''
+    Works out how many seconds a response can be used without checking back with the server
+
+    @param headers the response headers (case insensitive mapping)
+    @return seconds the response stays fresh, 0 if it has to be revalidated every time, None if it must not be stored at all
+    '''
+    cache_control = [d.strip().lower() for d in headers.get("Cache-Control", "").split(",") if d.strip()]
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0
+
+    lifetime = 0
+    for directive in cache_control:
+        if directive.startswith("max-age="):
+            try:
+                lifetime = int(directive.split("=", 1)[1].strip('"'))
+            except ValueError:
+                lifetime = 0
+            break
+    else:
+        # no max-age, fall back on Expires relative to the servers own clock
+        expires = headers.get("Expires")
+        if expires:
+            try:
+                date = headers.get("Date")
+                now = parsedate_to_datetime(date).timestamp() if date else time.time()
+                lifetime = parsedate_to_datetime(expires).timestamp() - now
+            except (TypeError, ValueError):
+                lifetime = 0
+
+    # time the response already spent sitting in a cdn cache counts against it
+    try:
+        lifetime -= int(headers.get("Age", 0))
+    except ValueError:
+        pass
+    return max(lifetime, 0)
+
+class ResponseCache:
+    '''
+    ResponseCache Class. Keeps parsed NWS response bodies along with their validators and expiry time. It does not make any
+    requests itself, the caller checks fresh(), sends the headers from validators(), and hands the response back to store() or
+    revalidated(). Cached bodies are shared between callers so they should be treated as read only.
+    '''
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        '''
+        ResponseCache object initialization method (constructor)
+
+        @param max_entries max number of responses kept, least recently used are dropped first
+        '''
+        self._entries = MemoryCache(max_entries)
+
+    def fresh(self, url):
+        '''
+        @param url the request url
+        @return the cached body if it is still fresh, None if the network has to be used
+        '''
+        entry = self._entries.get(url)
+        if entry is not None and entry["expires_at"] > time.time():
+            return entry["body"]
+        return None
+
+    def validators(self, url):
+        '''
+        @param url the request url
+        @return dictionary of conditional request headers for a stale cached response, empty if there is nothing to revalidate
+        '''
+        entry = self._entries.get(url)
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, headers, body):
+        '''
+        Saves a full (200) response
+
+        @param url the request url
+        @param headers the response headers
+        @param body the parsed json body
+        '''
+        lifetime = freshness_lifetime(headers)
+        if lifetime is None:
+            self._entries.delete(url)
+            return
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        # nothing to gain from keeping a response that is never fresh and cant be revalidated
+        if lifetime == 0 and not etag and not last_modified:
+            return
+        self._entries.set(url, {
+            "body": body,
+            "etag": etag,
+            "last_modified": last_modified,
+            "expires_at": time.time() + lifetime,
+        })
+
+    def revalidated(self, url, headers):
+        '''
+        Handles a 304 Not Modified, the cached body is still good and gets a new expiry time from the 304 headers
+
+        @param url the request url
+        @param headers the 304 response headers
+        @return the cached body, None if it was evicted while the request was in flight
+        '''
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        lifetime = freshness_lifetime(headers) or 0
+        self._entries.set(url, {
+            "body": entry["body"],
+            "etag": headers.get("ETag") or entry["etag"],
+            "last_modified": headers.get("Last-Modified") or entry["last_modified"],
+            "expires_at": time.time() + lifetime,
+        })
+        return entry["body"]
+
+    def clear(self):
+        ''' Drops every cached response '''
+        self._entries.clear()
+
+# the cache shared by everything that talks to nws (Data_Fetcher and AsyncDataFetcher)
+response_cache = ResponseCache()
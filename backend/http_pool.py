@@ -0,0 +1,70 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from backend.rate_limiter import throttle
+'''
+Shared HTTP connection pool for WeatherBear. Every outgoing call to api.weather.gov and nominatim.openstreetmap.org goes thru here
+so the TCP + TLS handshake is paid once per connection instead of once per request. One keep-alive session is kept per host and
+shared by every Data_Fetcher / User in the process (flask request threads and the APScheduler thread alike).
+'''
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+''' Max number of keep-alive connections kept open to a single host'''
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+''' Seconds to wait for a connection to a host to open'''
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+''' Seconds to wait for a host to send back data'''
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+''' Timeout used when a caller does not pass its own'''
+
+# one session per host, guarded by a lock so two threads asking for a new host at the same time dont both build one
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(url):
+    '''
+    Gets the shared keep-alive session for the host in the url, creating it the first time the host is seen
+
+    @param url any url on the host
+    @return the requests.Session for that host
+    '''
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                # nothing we call needs cookies, blocking them leaves the session with no shared state that threads could trip over
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                # pool_block makes extra threads wait for a free connection rather than opening throwaway ones past the limit
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=True)
+                session.mount(host, adapter)
+                _sessions[host] = session
+    return session
+
+def http_get(url, headers=None, timeout=None, **kwargs):
+    '''
+    Makes a GET request thru the pooled session for the urls host. Drop in replacement for requests.get.
+    Waits on the hosts rate limit first.
+
+    @param url the url to request
+    @param headers dictionary of request headers
+    @param timeout seconds (or a (connect, read) tuple) to wait, DEFAULT_TIMEOUT if not given
+    @return the requests.Response
+    '''
+    throttle(url)
+    return get_session(url).get(url, headers=headers, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+
+def close_sessions():
+    '''
+    Closes every pooled session, used when the app shuts down
+    '''
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,176 @@
+import os
+import time
+import random
+import hashlib
+import threading
+import openai
+from backend.rate_limiter import throttle, OPENAI_HOST
+'''
+LLM backends the Summarizer talks to. OpenAIBackend is what runs in production. StubBackend never touches the network, it returns
+deterministic text after a simulated delay so the summarize path can be load tested, our own overhead measured apart from the
+providers, and benchmarks run on a machine with no network or api key.
+
+The backend is picked with the SUMMARIZER_BACKEND environment variable, "openai" (default) or "stub".
+'''
+SUMMARIZER_BACKEND = os.getenv("SUMMARIZER_BACKEND", "openai")
+''' Which backend get_backend() returns, "openai" or "stub"'''
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+''' Model used for summaries and explanations'''
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+''' How many times an LLM call that was rate limited (429) is retried before giving up'''
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+''' First wait after a 429 when openai does not say how long to wait, doubled on every retry'''
+STUB_LATENCY_SECONDS = float(os.getenv("STUB_LATENCY_SECONDS", "0.5"))
+''' Simulated time to first token for the stub backend'''
+STUB_WORD_SECONDS = float(os.getenv("STUB_WORD_SECONDS", "0.01"))
+''' Simulated time per generated word for the stub backend'''
+
+class LLMBackend:
+    '''
+    LLMBackend Class. Interface every backend implements, takes openai style chat messages and returns the models reply.
+    '''
+    def complete(self, messages, temperature=0.7):
+        '''
+        @param messages list of {"role", "content"} chat message dictionaries
+        @param temperature sampling temperature
+        @return the reply text
+        '''
+        raise NotImplementedError
+
+    def stream(self, messages, temperature=0.7):
+        '''
+        @param messages list of {"role", "content"} chat message dictionaries
+        @param temperature sampling temperature
+        @return generator of reply text pieces as they are generated
+        '''
+        raise NotImplementedError
+
+class OpenAIBackend(LLMBackend):
+    '''
+    OpenAIBackend Class. Sends chat completions to openai through one shared client. Waits on the LLM rate limit before every
+    attempt and retries with exponential backoff when openai answers 429, so a busy batch slows down instead of failing.
+    '''
+    def __init__(self, model=OPENAI_MODEL):
+        '''
+        OpenAIBackend object initialization method (constructor)
+
+        @param model the openai model name
+        '''
+        self.model = model
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        '''
+        @return the openai client, created the first time it is needed so importing this module does not need an api key
+        '''
+        with self._lock:
+            if self._client is None:
+                self._client = openai.OpenAI(api_key=os.getenv("API_KEY"))
+            return self._client
+
+    def create(self, **kwargs):
+        '''
+        @param kwargs arguments for chat.completions.create, messages, temperature, stream, etc...
+        @return the openai response (or stream when stream=True)
+        '''
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            # wait our turn on the LLM rate limit, then create chat message
+            throttle(OPENAI_HOST)
+            try:
+                return self.client.chat.completions.create(model=self.model, **kwargs)
+            except openai.RateLimitError as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                wait = retry_delay(e, attempt)
+                print(f"OpenAI rate limited, retrying in {wait:.1f}s")
+                time.sleep(wait)
+
+    def complete(self, messages, temperature=0.7):
+        response = self.create(messages=messages, temperature=temperature)
+        return response.choices[0].message.content.strip()
+
+    def stream(self, messages, temperature=0.7):
+        for chunk in self.create(messages=messages, temperature=temperature, stream=True):
+            # chunks without choices only carry usage info
+            if not chunk.choices:
+                continue
+            piece = chunk.choices[0].delta.content
+            if piece:
+                yield piece
+
+class StubBackend(LLMBackend):
+    '''
+    StubBackend Class. Offline stand in for the LLM. The reply is built from a hash of the messages so the same prompt always gets
+    the same text, and it is returned after a simulated time to first token plus a simulated time per word.
+    '''
+    WORDS = ["high", "pressure", "builds", "overhead", "while", "a", "cold", "front", "approaches", "from", "the", "west",
+             "bringing", "scattered", "storms", "this", "afternoon", "with", "warm", "humid", "air", "ahead", "of", "it"]
+
+    def __init__(self, latency=STUB_LATENCY_SECONDS, word_seconds=STUB_WORD_SECONDS, words=80):
+        '''
+        StubBackend object initialization method (constructor)
+
+        @param latency simulated seconds before the first word
+        @param word_seconds simulated seconds per word
+        @param words number of words in every reply
+        '''
+        self.latency = latency
+        self.word_seconds = word_seconds
+        self.words = words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reply_words(self, messages):
+        '''
+        @param messages list of chat message dictionaries
+        @return the deterministic reply for the messages as a list of words
+        '''
+        with self._lock:
+            self.calls += 1
+        digest = hashlib.sha256("\0".join(m["content"] for m in messages).encode("utf-8")).digest()
+        rng = random.Random(digest)
+        return [rng.choice(self.WORDS) for _ in range(self.words)]
+
+    def complete(self, messages, temperature=0.7):
+        words = self.reply_words(messages)
+        time.sleep(self.latency + self.word_seconds * len(words))
+        return " ".join(words).capitalize() + "."
+
+    def stream(self, messages, temperature=0.7):
+        words = self.reply_words(messages)
+        time.sleep(self.latency)
+        for i, word in enumerate(words):
+            time.sleep(self.word_seconds)
+            piece = word.capitalize() if i == 0 else " " + word
+            yield piece + ("." if i == len(words) - 1 else "")
+
+def retry_delay(error, attempt):
+    '''
+    @param error the openai.RateLimitError
+    @param attempt how many attempts have failed so far, starting at 0
+    @return seconds to wait, openais retry-after header if it sent one, otherwise exponential backoff with jitter
+    '''
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return LLM_RETRY_BASE_SECONDS * (2 ** attempt) * (1 + random.random() / 2)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    '''
+    @return the process wide backend chosen by SUMMARIZER_BACKEND, created on first use
+    '''
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if SUMMARIZER_BACKEND == "stub":
+                _backend = StubBackend()
+            elif SUMMARIZER_BACKEND == "openai":
+                _backend = OpenAIBackend()
+            else:
+                raise ValueError(f"Unknown SUMMARIZER_BACKEND: {SUMMARIZER_BACKEND}")
+        return _backend
@@ -1,55 +1,135 @@
-import time
-from datetime import datetime
+import os
 from backend.data_fetcher import Data_Fetcher
 from backend.summarizer import Summarizer
-from backend.emailer import Emailer
-from backend.user import User, load_users, save_users
+from backend.summary_executor import SummaryExecutor, SUMMARY_WORKERS
+from backend.emailer import Emailer, body_cache_stats
+from backend.outbox import outbox
+from backend.pipeline import Pipeline, Stage
+from backend.batch_planner import BatchPlanner
+from backend.user_store import due_users, update_times_sent
 '''
 Driver of the email-bot app functionality on the website. Calls the functions that load the data, builds the emails, and sends them
 '''
+SUMMARIZE_WORKERS = int(os.getenv("BATCH_SUMMARIZE_WORKERS", str(SUMMARY_WORKERS)))
+''' LLM summaries generated at once during a batch'''
+RENDER_WORKERS = int(os.getenv("BATCH_RENDER_WORKERS", "2"))
+''' Emails rendered at once during a batch'''
 
 def main_loop():
     '''
-    Handles looping for the list of users loaded in by the load_users() function and sending emails if
-    it is during one of the users selected times.
+    Handles sending emails to the users who are due one, the users whose selected times include the current hour in
+    their time zone.
     '''
-    users = load_users()
-    changes_made = False
+    # only the users with a send slot this hour are loaded, should_get_email() also records the hour so a user is not sent
+    # the same hour twice
+    due = due_users()
+    if not due:
+        return
 
-    # loop thru users
-    for user in users:
-        if user.should_get_email():
-            send_email_to_user(user)
-            time.sleep(30) # sleeping for 30 seconds in order to prevent nws api from not providing the afd
-            changes_made = True
+    # resolve everyone up front and fetch each office / zone / grid cell / station product once, no matter how many users share it
+    planner = BatchPlanner(due).run()
+    print(f"Batch plan: {planner.stats()}")
 
-    # Resave the users.json file if an email was sent to update the times_sent field and prevent repeat sending in the hour
-    if changes_made:
-        save_users(users)
+    # every user then goes summarize -> render -> enqueue, with all three stages working at once. No sleep needed between
+    # users, outgoing calls are paced by the per-host limits in backend/rate_limiter.py
+    with SummaryExecutor(SUMMARIZE_WORKERS) as executor:
+        pipeline = Pipeline([
+            Stage("summarize", lambda job: summarize_stage(job, executor), SUMMARIZE_WORKERS),
+            Stage("render", render_stage, RENDER_WORKERS),
+            # only a local file write, the outbox delivery job does the sending so a slow mail server never holds up the batch
+            Stage("enqueue", enqueue_stage),
+        ], on_error=report_failure)
+        stats = pipeline.run(planner.jobs(on_error=report_failure))
+        print(f"Batch: {stats['completed']} of {len(due)} emails queued, failures {stats['failed']}, summaries {executor.stats()}, email bodies {body_cache_stats()}")
+
+    # save the times_sent field of the users that were sent to prevent repeat sending in the hour
+    update_times_sent(due)
+
+def fetch_stage(job):
+    '''
+    Collects the forecast data a users email is built from
+
+    @param job dictionary with the user
+    @return the job with forecast added, a dictionary with discussion, alerts, daily, obs, hourly, office, and issuance_time
+    '''
+    user = job["user"]
+    print("Gathering Data")
+    df = Data_Fetcher(user.location, user.units)
+    forecast_discussion, organized_alerts, daily_forecasts, obs_data, hourly_forecast = df.get_forecast()
+    job["forecast"] = {
+        "discussion": forecast_discussion,
+        "alerts": organized_alerts,
+        "daily": daily_forecasts,
+        "obs": obs_data,
+        "hourly": hourly_forecast,
+        "office": df.forecast_office,
+        "issuance_time": df.afd_issuance_time
+    }
+    return job
+
+def summarize_stage(job, executor = None):
+    '''
+    Summarizes the afd at the users knowledge level
+
+    @param job dictionary with the user and forecast
+    @param executor SummaryExecutor that shares summaries between users of the same afd & level, summarizes directly if None
+    @return the job with summary added
+    '''
+    user = job["user"]
+    forecast = job["forecast"]
+    print("Generating Summary")
+    level = user.preferences["weather_knowledge"]
+    if executor is not None:
+        job["summary"] = executor.submit(level, forecast["discussion"], forecast["office"], forecast["issuance_time"]).result()
+    else:
+        job["summary"] = Summarizer(level, forecast["discussion"], forecast["office"], forecast["issuance_time"]).generate_Message()
+    return job
+
+def render_stage(job):
+    '''
+    Builds the email message
+
+    @param job dictionary with the user, forecast, and summary
+    @return the job with message added
+    '''
+    forecast = job["forecast"]
+    print(f"Generating Email")
+    emailer = Emailer(job["user"], forecast["obs"], forecast["daily"], forecast["alerts"], job["summary"])
+    job["message"] = emailer.build_message()
+    return job
+
+def enqueue_stage(job):
+    '''
+    Puts the email in the outbox, it is sent (and retried if need be) by the outbox delivery job
+
+    @param job dictionary with the user and message
+    @return the job
+    '''
+    outbox.enqueue(job["message"])
+    print(f"Email queued for {job['user'].email}")
+    return job
+
+def report_failure(job, stage, error):
+    '''
+    Prints a failed user, one user failing never stops the rest of the batch
+
+    @param job the job that failed
+    @param stage name of the stage it failed in
+    @param error the exception
+    '''
+    print(f"Failed to send email to {job['user'].email} ({stage}): {error}")
 
 def send_email_to_user(user):
     '''
     Executes the process of sending an email to the specified user object
     '''
+    job = {"user": user}
+    stage = "fetch"
     try:
-        print("Gathering Data")
-        # Collect Data
-        df = Data_Fetcher(user.location, user.units)
-        forecast_discussion, organized_alerts, daily_forecasts, obs_data, hourly_forecast = df.get_forecast()
-
-        # Summarize response
-        summarizer = Summarizer(user.preferences["weather_knowledge"], forecast_discussion)
-        print("Generating Summary")
-        summary = summarizer.generate_Message()
-
-        # Generate and send email
-        emailer = Emailer(user, obs_data, daily_forecasts, organized_alerts, summary)
-        print(f"Generating Email")
-
-        emailer.send_email()
-        print(f"Email sent to {user.email}")
+        for stage, run in [("fetch", fetch_stage), ("summarize", summarize_stage), ("render", render_stage), ("enqueue", enqueue_stage)]:
+            job = run(job)
     except Exception as e:
-        print(f"Failed to send email to {user.email}: {e}")
+        report_failure(job, stage, e)
 
 if __name__ == "__main__":
     pass
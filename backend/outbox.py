@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import uuid
+import email
+import random
+import smtplib
+import threading
+from email import policy
+from concurrent.futures import ThreadPoolExecutor
+from backend.smtp_pool import get_smtp_pool, SMTP_POOL_SIZE
+'''
+Durable on-disk outbox between building emails and sending them. The batch only enqueues rendered messages, which is a local file
+write, and a separate delivery job drains the outbox through the SMTP pool. A slow or failing mail server no longer holds up the
+batch, failed sends are retried with exponential backoff, messages that keep failing (or are refused outright) are moved to a
+dead letter folder instead of being lost, and a restart picks up delivery where it stopped.
+
+Every message is one json file that moves between three folders with atomic renames:
+    pending/   waiting to be sent, file names start with the time the message is next due so a sorted listing is in due order
+    inflight/  claimed by a delivery run, moved back to pending if the run died before finishing it
+    dead/      gave up on it, kept for a person to look at
+'''
+OUTBOX_DIR = os.getenv("OUTBOX_DIR", "/mnt/data/outbox")
+''' Directory the outbox folders live in, next to users.json on the server'''
+OUTBOX_DELIVER_SECONDS = int(os.getenv("OUTBOX_DELIVER_SECONDS", "15"))
+''' Seconds between delivery runs'''
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+''' Max number of messages handled by one delivery run'''
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+''' Send attempts before a message is dead lettered'''
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "30"))
+''' Wait after the first failed attempt, doubled after every attempt after that'''
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "1800"))
+''' Longest wait between two attempts'''
+OUTBOX_INFLIGHT_SECONDS = int(os.getenv("OUTBOX_INFLIGHT_SECONDS", "300"))
+''' A claimed message not finished after this long belongs to a run that died, it is put back in pending'''
+
+PENDING = "pending"
+INFLIGHT = "inflight"
+DEAD = "dead"
+
+def retry_delay(attempts):
+    '''
+    @param attempts how many attempts have failed so far, starting at 1
+    @return seconds to wait before the next attempt, exponential backoff with jitter capped at OUTBOX_RETRY_MAX_SECONDS
+    '''
+    delay = OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    return min(delay, OUTBOX_RETRY_MAX_SECONDS) * (1 + random.random() / 4)
+
+def permanent_failure(error):
+    '''
+    @param error exception raised while sending
+    @return true if retrying can not help, only when the server refused this message itself: every recipient refused with a 5xx
+    at RCPT, or the message refused with a 5xx after DATA
+    '''
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPDataError):
+        return 500 <= error.smtp_code < 600
+    return False
+
+def server_failure(error):
+    '''
+    @param error exception raised while sending
+    @return true if the error is about the mail server or our account rather than the message (can not connect, login refused,
+    sender refused, connection dropped), every other message would fail the same way right now
+    '''
+    return not isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError))
+
+class Outbox:
+    '''
+    Outbox Class. Folder backed message queue, safe to share between threads and processes since every state change is a rename.
+    '''
+    def __init__(self, path=OUTBOX_DIR, max_attempts=OUTBOX_MAX_ATTEMPTS, inflight_seconds=OUTBOX_INFLIGHT_SECONDS):
+        '''
+        Outbox object initialization method (constructor)
+
+        @param path directory the pending, inflight, and dead folders are kept in
+        @param max_attempts send attempts before a message is dead lettered
+        @param inflight_seconds claimed messages older than this are put back in pending by recover()
+        '''
+        self.path = path
+        self.max_attempts = max_attempts
+        self.inflight_seconds = inflight_seconds
+        self._lock = threading.Lock()
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    def folder(self, state):
+        '''
+        @param state PENDING, INFLIGHT, or DEAD
+        @return path of the folder, created if it is not there yet
+        '''
+        path = os.path.join(self.path, state)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def enqueue(self, message):
+        '''
+        Durably queues a message, once this returns it will be sent even if the process dies
+
+        @param message email.message.EmailMessage to send
+        @return the id of the queued message
+        '''
+        record = {
+            "id": uuid.uuid4().hex,
+            "to": message["To"],
+            "raw": message.as_string(),
+            "attempts": 0,
+            "created": time.time(),
+            "next_attempt": time.time(),
+            "last_error": None,
+        }
+        self._write(PENDING, record)
+        return record["id"]
+
+    def deliver(self, send=None, limit=OUTBOX_BATCH_SIZE, workers=SMTP_POOL_SIZE):
+        '''
+        One delivery run. Puts abandoned messages back, then claims due messages a few at a time and sends them
+
+        @param send function that sends an EmailMessage, the smtp pool if None
+        @param limit max number of messages handled in this run
+        @param workers messages sent at once, more than the smtp pool size just wait on the pool
+        @return dictionary with the number of messages sent, retried, dead lettered, put back unsent, and skipped (taken over by
+        another run) in this run
+        '''
+        send = send or get_smtp_pool().send
+        workers = max(1, workers)
+        self.recover()
+        results = {"sent": 0, "retried": 0, "dead": 0, "released": 0, "skipped": 0}
+
+        # only as many messages are claimed as are about to be sent, and no more are claimed once half the inflight window has
+        # gone by, so a slow mail server can never leave a claim sitting long enough for recover() to hand it to another run
+        deadline = time.monotonic() + self.inflight_seconds / 2
+        # set when the mail server itself fails (cant connect, login refused), the rest of the claim is put back untouched
+        # instead of every message using up an attempt on the same outage
+        halt = threading.Event()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox") as pool:
+            while not halt.is_set() and time.monotonic() < deadline:
+                handled = sum(results.values())
+                if handled >= limit:
+                    break
+                claimed = self.claim(min(workers, limit - handled))
+                if not claimed:
+                    break
+                for outcome in pool.map(lambda name: self._deliver_one(name, send, halt), claimed):
+                    results[outcome] += 1
+
+        if any(results.values()):
+            print(f"Outbox: {results}, {self.counts()}")
+        return results
+
+    def claim(self, limit=OUTBOX_BATCH_SIZE):
+        '''
+        Moves due messages from pending to inflight, a message another run claimed first is skipped
+
+        @param limit max number of messages claimed
+        @return list of claimed file names
+        '''
+        pending = self.folder(PENDING)
+        inflight = self.folder(INFLIGHT)
+        now_ms = int(time.time() * 1000)
+        claimed = []
+        for name in sorted(os.listdir(pending)):
+            if len(claimed) >= limit:
+                break
+            if not name.endswith(".json"):
+                continue
+            # names start with the due time, everything after the first message that is not due yet is not due either
+            if int(name.split("-", 1)[0]) > now_ms:
+                break
+            try:
+                os.replace(os.path.join(pending, name), os.path.join(inflight, name))
+            except FileNotFoundError:
+                continue
+            # the claim time, recover() goes by it
+            os.utime(os.path.join(inflight, name))
+            claimed.append(name)
+        return claimed
+
+    def _deliver_one(self, name, send, halt):
+        '''
+        @param name file name of a claimed message
+        @param send function that sends an EmailMessage
+        @param halt threading.Event, set once the mail server has failed during this run
+        @return "sent", "retried", "dead", "released" (put back in pending unsent because the run was halted), or "skipped"
+        '''
+        inflight_path = os.path.join(self.folder(INFLIGHT), name)
+        try:
+            if halt.is_set():
+                os.replace(inflight_path, os.path.join(self.folder(PENDING), name))
+                return "released"
+            # refresh the claim right before sending, recover() only takes messages nobody has touched for the inflight window
+            os.utime(inflight_path)
+            with open(inflight_path) as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            # recover() in another run already put it back, that run owns it now
+            return "skipped"
+
+        try:
+            send(email.message_from_string(record["raw"], policy=policy.default))
+        except Exception as e:
+            if server_failure(e) and not halt.is_set():
+                halt.set()
+                print(f"Outbox stopping this run, the mail server failed: {type(e).__name__}: {e}")
+            record["attempts"] += 1
+            record["last_error"] = f"{type(e).__name__}: {e}"
+            if permanent_failure(e) or record["attempts"] >= self.max_attempts:
+                self._write(DEAD, record)
+                self._drop(inflight_path)
+                print(f"Outbox gave up on email to {record['to']} after {record['attempts']} attempts: {record['last_error']}")
+                return self._count("dead")
+            record["next_attempt"] = time.time() + retry_delay(record["attempts"])
+            # written back to pending before the claim is dropped, a crash in between can not lose the message
+            self._write(PENDING, record)
+            self._drop(inflight_path)
+            print(f"Outbox retrying email to {record['to']} in {record['next_attempt'] - time.time():.0f}s: {record['last_error']}")
+            return self._count("retried")
+
+        self._drop(inflight_path)
+        return self._count("sent")
+
+    def recover(self, max_age=None):
+        '''
+        Puts messages claimed by a run that never finished (the process was killed or restarted mid send) back in pending
+
+        @param max_age seconds since the claim after which a message counts as abandoned, inflight_seconds if None
+        @return number of messages put back
+        '''
+        max_age = self.inflight_seconds if max_age is None else max_age
+        pending = self.folder(PENDING)
+        inflight = self.folder(INFLIGHT)
+        requeued = set()
+        recovered = 0
+        for name in os.listdir(inflight):
+            path = os.path.join(inflight, name)
+            try:
+                if time.time() - os.path.getmtime(path) < max_age:
+                    continue
+                # a failed attempt may have been written back to pending right before the crash, dont queue it twice
+                if not requeued:
+                    requeued = {n.split("-", 1)[-1] for n in os.listdir(pending)}
+                if name.split("-", 1)[-1] in requeued:
+                    os.remove(path)
+                else:
+                    os.replace(path, os.path.join(pending, name))
+                    recovered += 1
+            except FileNotFoundError:
+                # another run recovered or finished it first
+                continue
+        if recovered:
+            print(f"Outbox recovered {recovered} abandoned messages")
+        return recovered
+
+    def _drop(self, path):
+        '''
+        @param path inflight file of a message that is done, already gone if another run took the claim over mid send
+        '''
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _write(self, state, record):
+        '''
+        Writes a message record into a folder atomically, readers only ever see complete files
+
+        @param state PENDING or DEAD
+        @param record the message record dictionary
+        '''
+        name = f"{int(record['next_attempt'] * 1000):014d}-{record['id']}.json"
+        folder = self.folder(state)
+        tmp_path = os.path.join(folder, f".{name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(folder, name))
+
+    def _count(self, outcome):
+        '''
+        @param outcome "sent", "retried", or "dead"
+        @return the outcome, after adding it to the running totals
+        '''
+        with self._lock:
+            if outcome == "sent":
+                self.delivered += 1
+            elif outcome == "retried":
+                self.retried += 1
+            else:
+                self.dead += 1
+        return outcome
+
+    def counts(self):
+        '''
+        @return dictionary with the number of messages in each folder
+        '''
+        return {state: sum(1 for name in os.listdir(self.folder(state)) if name.endswith(".json")) for state in (PENDING, INFLIGHT, DEAD)}
+
+    def stats(self):
+        '''
+        @return dictionary with the folder counts plus messages delivered, retried, and dead lettered by this process
+        '''
+        with self._lock:
+            totals = {"delivered": self.delivered, "retried": self.retried, "dead_lettered": self.dead}
+        return {**self.counts(), **totals}
+
+# shared by the batch (enqueue) and the delivery job
+outbox = Outbox()
+
+def deliver_outbox():
+    '''
+    Scheduler entry point, runs one delivery run of the shared outbox
+    '''
+    outbox.deliver()
@@ -0,0 +1,104 @@
+import os
+import queue
+import threading
+'''
+Small staged worker pipeline for the email batch. Each stage has its own pool of worker threads and hands its results to the
+next stage through a bounded queue, so every stage works at the same time (forecasts are being fetched while earlier users are
+summarized, rendered, and sent) and a slow stage makes the stages before it wait instead of piling up work in memory. An item
+that fails in any stage is dropped from the pipeline and reported, the rest of the batch keeps going.
+'''
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "50"))
+''' Max number of items waiting between two stages'''
+
+# put on a stage queue once per worker to tell the workers there is nothing else coming
+_DONE = object()
+
+class Stage:
+    '''
+    Stage Class. One step of the pipeline, a function run on every item by a number of worker threads.
+    '''
+    def __init__(self, name, fn, workers=1):
+        '''
+        Stage object initialization method (constructor)
+
+        @param name stage name used in stats and error messages
+        @param fn function that takes an item and returns the item to pass to the next stage (None drops it)
+        @param workers number of threads running this stage
+        '''
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+
+class Pipeline:
+    '''
+    Pipeline Class. Runs items through a list of stages with bounded queues between them.
+    '''
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, on_error=None):
+        '''
+        Pipeline object initialization method (constructor)
+
+        @param stages list of Stage objects, in order
+        @param queue_size max number of items waiting in front of each stage
+        @param on_error function called with (item, stage name, exception) when a stage fails on an item, prints by default
+        '''
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_error = on_error or (lambda item, stage, e: print(f"Pipeline stage {stage} failed: {e}"))
+
+    def run(self, items):
+        '''
+        Pushes every item through the pipeline and waits for all of them to finish
+
+        @param items iterable of items, read lazily so a generator is never held in memory all at once
+        @return dictionary with completed (items that made it through every stage), and failed (stage name -> failure count)
+        '''
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        stats = {"completed": 0, "failed": {stage.name: 0 for stage in self.stages}}
+        stats_lock = threading.Lock()
+        remaining = [stage.workers for stage in self.stages]
+        threads = []
+
+        def work(index):
+            stage = self.stages[index]
+            while True:
+                item = queues[index].get()
+                if item is _DONE:
+                    break
+                try:
+                    result = stage.fn(item)
+                except Exception as e:
+                    with stats_lock:
+                        stats["failed"][stage.name] += 1
+                    self.on_error(item, stage.name, e)
+                    continue
+                if result is None:
+                    continue
+                if index + 1 < len(self.stages):
+                    # blocks while the next stage is behind, that is the backpressure
+                    queues[index + 1].put(result)
+                else:
+                    with stats_lock:
+                        stats["completed"] += 1
+
+            # the last worker out of a stage tells the next stage nothing else is coming
+            with stats_lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].workers):
+                    queues[index + 1].put(_DONE)
+
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(target=work, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        return stats
@@ -0,0 +1,118 @@
+import os
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+'''
+Per-host rate limiting for every outgoing call WeatherBear makes (NWS, Nominatim, and the LLM api). Each host gets a token bucket
+with a sustained rate and a burst size, shared by every thread in the process, so batch work can go as fast as the upstream usage
+policies allow instead of sleeping a fixed amount between users.
+
+Limits can be changed with the RATE_LIMITS environment variable, a comma separated list of host=rate:burst pairs. For example
+RATE_LIMITS="api.weather.gov=5:10,nominatim.openstreetmap.org=1:1". Hosts without a limit are not throttled.
+'''
+OPENAI_HOST = "api.openai.com"
+''' Host the LLM calls go to'''
+DEFAULT_RATE_LIMITS = {
+    "api.weather.gov": (5, 10),
+    # Nominatim usage policy is an absolute max of 1 request per second
+    "nominatim.openstreetmap.org": (1, 1),
+    OPENAI_HOST: (5, 10),
+}
+''' host -> (requests per second, burst size) used when RATE_LIMITS does not say otherwise'''
+
+class TokenBucket:
+    '''
+    TokenBucket Class. Holds up to burst tokens which refill at rate tokens per second, every request takes one. When the bucket is
+    empty callers reserve a future token and sleep until it is theirs, so waiting callers are served in order without polling.
+    '''
+    def __init__(self, rate, burst):
+        '''
+        TokenBucket object initialization method (constructor)
+
+        @param rate sustained requests per second
+        @param burst max number of requests that can go out back to back
+        '''
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        '''
+        Takes a token, going into debt if the bucket is empty
+
+        @return seconds the caller has to wait before its token is available
+        '''
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        ''' Blocks the calling thread until a request is allowed '''
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        ''' Waits (without blocking the event loop) until a request is allowed '''
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+def parse_rate_limits(spec):
+    '''
+    Parses a RATE_LIMITS string
+
+    @param spec comma separated host=rate:burst pairs
+    @return dictionary of host -> (rate, burst)
+    '''
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            host, values = item.split("=", 1)
+            rate, _, burst = values.partition(":")
+            rate = float(rate)
+            limits[host.strip().lower()] = (rate, float(burst) if burst else max(rate, 1))
+        except ValueError:
+            print(f"Ignoring invalid rate limit: {item}")
+    return limits
+
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **parse_rate_limits(os.getenv("RATE_LIMITS", ""))}
+''' host -> (requests per second, burst size) actually in use'''
+
+_buckets = {host: TokenBucket(rate, burst) for host, (rate, burst) in RATE_LIMITS.items() if rate > 0}
+
+def limiter_for(url):
+    '''
+    @param url a url or bare host name
+    @return the TokenBucket for the host, None if the host is not rate limited
+    '''
+    host = urlsplit(url).hostname if "://" in url else url
+    return _buckets.get((host or "").lower())
+
+def throttle(url):
+    '''
+    Blocks until a request to the urls host is allowed, returns right away for hosts without a limit
+
+    @param url a url or bare host name
+    '''
+    bucket = limiter_for(url)
+    if bucket is not None:
+        bucket.acquire()
+
+async def throttle_async(url):
+    '''
+    Async version of throttle()
+
+    @param url a url or bare host name
+    '''
+    bucket = limiter_for(url)
+    if bucket is not None:
+        await bucket.acquire_async()
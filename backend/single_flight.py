@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import Future
+'''
+Single-flight request coalescing. When several threads ask for the same thing at the same moment (the top of the hour email batch,
+a burst of people checking a severe weather day) only the first one does the work, the rest wait on it and share its result.
+'''
+
+class SingleFlight:
+    '''
+    SingleFlight Class. Runs at most one call per key at a time, callers that show up while a call for their key is already in
+    flight get that calls result (or exception) instead of running their own. Keeps counters of how much work was saved.
+    '''
+    def __init__(self):
+        '''
+        SingleFlight object initialization method (constructor)
+        '''
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        '''
+        Runs fn(*args, **kwargs) unless a call for the same key is already running, in which case its result is shared
+
+        @param key identifies the work, the request url for example
+        @param fn the function to run
+        @return whatever fn returns, exceptions raised by fn are raised to every waiting caller
+        '''
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._in_flight[key] = future
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self):
+        '''
+        @return dictionary with the number of calls actually made, the number of callers that shared another call, and
+            the number of calls running right now
+        '''
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
@@ -0,0 +1,189 @@
+import os
+import time
+import smtplib
+import threading
+'''
+Pool of persistent, logged in SMTP sessions. Opening a connection, running STARTTLS, and logging in costs several round trips,
+and doing it for every email in the top of the hour batch gets us throttled by the provider. The pool keeps sessions open across
+a batch and sends many messages on each, reconnecting when the provider drops a session and recycling sessions after a number
+of messages or once they have sat idle long enough that the provider has likely closed them.
+'''
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+''' Mail server host'''
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+''' Mail server port'''
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() not in ("0", "false", "no")
+''' Whether to upgrade connections with STARTTLS, only turned off for the local stand-in server'''
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+''' Max number of sessions open (and messages being sent) at once'''
+SMTP_MESSAGES_PER_SESSION = int(os.getenv("SMTP_MESSAGES_PER_SESSION", "100"))
+''' Messages sent on a session before it is closed and a fresh one is opened'''
+SMTP_IDLE_SECONDS = int(os.getenv("SMTP_IDLE_SECONDS", "60"))
+''' Sessions unused for longer than this are closed instead of reused'''
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+''' Socket timeout for SMTP connections'''
+SMTP_SEND_RETRIES = int(os.getenv("SMTP_SEND_RETRIES", "2"))
+''' Times a message is retried on a fresh session after the connection fails'''
+
+class SMTPPool:
+    '''
+    SMTPPool Class. Hands out logged in smtplib.SMTP sessions, at most size at a time, and puts healthy ones back for reuse.
+    '''
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username=None, password=None, starttls=SMTP_STARTTLS,
+                 size=SMTP_POOL_SIZE, max_messages=SMTP_MESSAGES_PER_SESSION, idle_seconds=SMTP_IDLE_SECONDS):
+        '''
+        SMTPPool object initialization method (constructor)
+
+        @param host mail server host
+        @param port mail server port
+        @param username login username, no login if None
+        @param password login password
+        @param starttls whether to run STARTTLS before logging in
+        @param size max number of sessions open at once
+        @param max_messages messages sent on a session before it is recycled
+        @param idle_seconds sessions unused for longer than this are closed instead of reused
+        '''
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.sent = 0
+
+    def send(self, message):
+        '''
+        Sends a message on a pooled session, retrying on a fresh session if the connection fails
+
+        @param message email.message.EmailMessage to send
+        @raise smtplib.SMTPException (or OSError) if the message could not be sent
+        '''
+        with self._slots:
+            for attempt in range(SMTP_SEND_RETRIES + 1):
+                # retries always get a new connection, if one idle session was dropped the others likely were too
+                session = self._checkout() if attempt == 0 else self._connect()
+                try:
+                    session["smtp"].send_message(message)
+                except OSError as e:
+                    if not session_broken(e):
+                        # the message was rejected but the session is fine
+                        self._checkin(session)
+                        raise
+                    # the session is dead (provider closed it, network blip), throw it away and try a new one
+                    self._discard(session)
+                    if attempt == SMTP_SEND_RETRIES:
+                        raise
+                    print(f"SMTP connection failed, reconnecting: {e}")
+                    continue
+                session["sent"] += 1
+                with self._lock:
+                    self.sent += 1
+                self._checkin(session)
+                return
+
+    def _checkout(self):
+        '''
+        @return a session dictionary (smtp, sent, last_used), reusing an idle one when there is a fresh enough one
+        '''
+        while True:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                return self._connect()
+            if time.monotonic() - session["last_used"] <= self.idle_seconds:
+                return session
+            # idle too long, the provider has probably hung up already
+            self._discard(session)
+
+    def _checkin(self, session):
+        '''
+        @param session session dictionary that is done sending, kept for reuse unless it has sent its share of messages
+        '''
+        if session["sent"] >= self.max_messages:
+            self._discard(session)
+            return
+        session["last_used"] = time.monotonic()
+        with self._lock:
+            self._idle.append(session)
+
+    def _connect(self):
+        '''
+        @return a new logged in session dictionary
+        '''
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self._lock:
+            self.connects += 1
+        return {"smtp": smtp, "sent": 0, "last_used": time.monotonic()}
+
+    def _discard(self, session):
+        '''
+        @param session session dictionary to close and forget
+        '''
+        self._close(session["smtp"])
+
+    def _close(self, smtp):
+        '''
+        @param smtp smtplib.SMTP connection to close, politely if the server is still listening
+        '''
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def stats(self):
+        '''
+        @return dictionary with the number of connections opened, messages sent, and idle sessions
+        '''
+        with self._lock:
+            return {"connects": self.connects, "sent": self.sent, "idle": len(self._idle)}
+
+    def close(self):
+        ''' Closes every idle session, used at shutdown '''
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        for session in sessions:
+            self._discard(session)
+
+def session_broken(error):
+    '''
+    @param error exception raised while sending, smtplib errors are OSErrors too
+    @return true if the error means the session can not be used anymore, false if only the message was refused
+    '''
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        # 421 is the server saying it is closing the connection, anything else is about the message
+        return getattr(error, "smtp_code", None) == 421
+    # socket level errors, resets, timeouts
+    return True
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_smtp_pool():
+    '''
+    @return the process wide pool, created on first use so the credentials from .env have been loaded by then
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPPool(username=os.getenv("SENDER_EMAIL"), password=os.getenv("EMAIL_APP_PASSWORD"))
+        return _pool
+
+def close_smtp_pool():
+    ''' Closes the process wide pools idle sessions, registered to run at exit '''
+    if _pool is not None:
+        _pool.close()
@@ -0,0 +1,198 @@
+import re
+import socket
+import threading
+import socketserver
+'''
+Tiny local SMTP server that stands in for the real mail provider. It speaks just enough SMTP for smtplib (EHLO/HELO, AUTH, MAIL,
+RCPT, DATA, RSET, NOOP, QUIT), accepts any login, and keeps every message it receives in memory along with connection and login
+counts, so the SMTP pool and the email batch can be exercised offline without sending real email.
+
+It can also be run on its own for local development, then point the app at it with SMTP_HOST=localhost SMTP_PORT=8025
+SMTP_STARTTLS=false:  python -m backend.smtp_standin
+'''
+
+def address(line):
+    '''
+    @param line a MAIL FROM or RCPT TO command, "MAIL FROM:<bear@weatherbear.org> SIZE=1200"
+    @return the address between the angle brackets
+    '''
+    match = re.search(r"<([^>]*)>", line)
+    return match.group(1) if match else line.split(":", 1)[-1].strip()
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    '''
+    Handles one SMTP connection
+    '''
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("utf-8"))
+
+    def handle(self):
+        server = self.server.standin
+        server.record("connections")
+        server.track(self.connection)
+        try:
+            self.converse(server)
+        except OSError:
+            # connection was dropped, by the client or by drop_connections()
+            pass
+        finally:
+            server.untrack(self.connection)
+
+    def converse(self, server):
+        self.reply("220 localhost WeatherBear SMTP stand-in ready")
+        sender, recipients = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            command = line.split(" ", 1)[0].upper()
+
+            if command == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif command == "HELO":
+                self.reply("250 localhost")
+            elif command == "AUTH":
+                parts = line.split()
+                mechanism = parts[1].upper() if len(parts) > 1 else ""
+                if mechanism == "LOGIN":
+                    # the username may come inline, the password always comes on its own line
+                    if len(parts) == 2:
+                        self.reply("334 VXNlcm5hbWU6")
+                        self.rfile.readline()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                elif len(parts) == 2:
+                    # AUTH PLAIN without the credentials inline
+                    self.reply("334 ")
+                    self.rfile.readline()
+                server.record("logins")
+                self.reply("235 Authentication successful")
+            elif command == "MAIL":
+                sender, recipients = address(line), []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                recipients.append(address(line))
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    # undo dot stuffing
+                    if data_line.startswith(b".."):
+                        data_line = data_line[1:]
+                    data.append(data_line)
+                server.deliver(sender, recipients, b"".join(data))
+                sender, recipients = None, []
+                self.reply("250 OK queued")
+            elif command == "RSET":
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif command == "NOOP":
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class LocalSMTPServer:
+    '''
+    LocalSMTPServer Class. Runs the stand-in server on a background thread and collects what it receives.
+    '''
+    def __init__(self, host="127.0.0.1", port=0):
+        '''
+        LocalSMTPServer object initialization method (constructor)
+
+        @param host interface to listen on
+        @param port port to listen on, 0 picks a free one (see self.port once started)
+        '''
+        self.host = host
+        self.port = port
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        self._open = set()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def track(self, connection):
+        '''
+        @param connection socket of a newly opened client connection
+        '''
+        with self._lock:
+            self._open.add(connection)
+
+    def untrack(self, connection):
+        '''
+        @param connection socket of a client connection that has ended
+        '''
+        with self._lock:
+            self._open.discard(connection)
+
+    def drop_connections(self):
+        '''
+        Cuts every open client connection without a goodbye, like a provider timing out idle sessions. Used to test reconnects
+        '''
+        with self._lock:
+            connections = list(self._open)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def record(self, counter):
+        '''
+        @param counter name of the counter to add one to, "connections" or "logins"
+        '''
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def deliver(self, sender, recipients, data):
+        '''
+        @param sender the MAIL FROM address
+        @param recipients list of RCPT TO addresses
+        @param data the raw message bytes
+        '''
+        with self._lock:
+            self.messages.append({"from": sender, "to": recipients, "data": data})
+
+    def start(self):
+        '''
+        Starts listening in a background thread
+
+        @return self, so it can be created and started in one line
+        '''
+        self._server = _ThreadingTCPServer((self.host, self.port), _SMTPHandler)
+        self._server.standin = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        ''' Stops the server '''
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+if __name__ == "__main__":
+    standin = LocalSMTPServer(port=8025).start()
+    print(f"SMTP stand-in listening on {standin.host}:{standin.port}, ctrl-c to stop")
+    seen = 0
+    try:
+        while True:
+            threading.Event().wait(1)
+            for message in standin.messages[seen:]:
+                print(f"--- message from {message['from']} to {', '.join(message['to'])}\n{message['data'].decode('utf-8', 'replace')}")
+            seen = len(standin.messages)
+    except KeyboardInterrupt:
+        standin.stop()
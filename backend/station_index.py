@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+'''
+Spatial index over NWS observation stations. Replaces looping over every station and calling Data_Fetcher.haversine() one at a
+time with a single numpy haversine over arrays of station coordinates. An index is built once per station list and cached, so
+every user in the same area reuses it.
+'''
+EARTH_RADIUS_KM = 6371
+''' Radius of the earth used in the haversine distance'''
+INDEX_CACHE_SIZE = 256
+''' Max number of station indexes kept in memory'''
+
+def station_signature(stations):
+    '''
+    @param stations list of station features
+    @return tuple of every stations id and coordinates, equal for two lists only if they hold the same stations in the same order
+    '''
+    return tuple((station.get('properties', {}).get('stationIdentifier'), tuple(station['geometry']['coordinates'][:2]))
+                 for station in stations)
+
+class StationIndex:
+    '''
+    StationIndex Class. Holds the station features along with their coordinates (in radians) as numpy arrays and answers nearest
+    and k-nearest station queries for a lat/lon.
+    '''
+    def __init__(self, stations):
+        '''
+        StationIndex object initialization method (constructor)
+
+        @param stations list of station features, each with ['geometry']['coordinates'] as [lon, lat]
+        '''
+        self.stations = stations
+        self.signature = station_signature(stations)
+        coords = np.array([station['geometry']['coordinates'][:2] for station in stations], dtype=float).reshape(-1, 2)
+        self._lon = np.radians(coords[:, 0])
+        self._lat = np.radians(coords[:, 1])
+        self._cos_lat = np.cos(self._lat)
+
+    def distances(self, lat, lon):
+        '''
+        Haversine distance from a point to every station at once
+
+        @param lat latitude of the point
+        @param lon longitude of the point
+        @return numpy array of distances in km, same order as self.stations
+        '''
+        lat1 = np.radians(lat)
+        lon1 = np.radians(lon)
+        a = np.sin((self._lat - lat1) / 2) ** 2 + np.cos(lat1) * self._cos_lat * np.sin((self._lon - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+    def nearest(self, lat, lon):
+        '''
+        @param lat latitude of the point
+        @param lon longitude of the point
+        @return the closest station feature, None if the index is empty
+        '''
+        if not self.stations:
+            return None
+        return self.stations[int(np.argmin(self.distances(lat, lon)))]
+
+    def k_nearest(self, lat, lon, k):
+        '''
+        @param lat latitude of the point
+        @param lon longitude of the point
+        @param k number of stations to return
+        @return list of (station feature, distance km) tuples for the k closest stations, closest first
+        '''
+        if not self.stations or k <= 0:
+            return []
+        dists = self.distances(lat, lon)
+        k = min(k, len(self.stations))
+        # argpartition finds the k smallest without sorting the whole list, then only those k get sorted
+        idx = np.argpartition(dists, k - 1)[:k]
+        idx = idx[np.argsort(dists[idx])]
+        return [(self.stations[i], float(dists[i])) for i in idx]
+
+# indexes keyed by the station list url, least recently used dropped once INDEX_CACHE_SIZE is hit
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_station_index(key, stations):
+    '''
+    Gets the cached index for a station list, building it the first time the list is seen
+
+    @param key identifies the station list, the NWS observationStations url
+    @param stations list of station features to index
+    @return the StationIndex for the list
+    '''
+    with _indexes_lock:
+        index = _indexes.get(key)
+        # the same list object (cached metadata) or the same stations, anything else means NWS changed the list under the same
+        # url and the index is rebuilt
+        if index is not None and (index.stations is stations or index.signature == station_signature(stations)):
+            _indexes.move_to_end(key)
+            return index
+
+    index = StationIndex(stations)
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
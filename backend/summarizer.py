@@ -1,30 +1,96 @@
-import requests
-import openai
-import os
+from backend.llm_backend import get_backend
+from backend.summary_cache import get_summary, store_summary
+from backend.afd_parser import compact_afd
+from backend.explanation_cache import explanation_key, afd_identity, get_explanation, store_explanation
 
 class Summarizer:
     '''
     Summarizer Class. Contains methods to summarize area forecast discussions and also explain selected sections of text from 
     the summarized forecast discussions that the user does not understand. 
     '''
-    def __init__(self, weather_knowledge, afd):
+    def __init__(self, weather_knowledge, afd, office = None, issuance_time = None, backend = None):
         '''
         Summarizer object initialization method (constructor)
 
         @param weather_knowledge the users weather expertise - controls the level at which the afd is summarized. Will either be 
             "expert", "moderate", "none", or "no_summary". Also controls the level at which text explanations are explained.
         @param afd the area forecast discussion that will be summarized
+        @param office the forecast office that issued the afd, none by default. Summaries are only cached if office and issuance_time are given
+        @param issuance_time the afds issuanceTime from NWS, none by default
+        @param backend the LLMBackend used to talk to the llm, the one picked by SUMMARIZER_BACKEND (openai unless told otherwise) by default
         '''
         self.weather_knowledge = weather_knowledge
         self.afd = afd
+        self.office = office
+        self.issuance_time = issuance_time
+        self.backend = backend if backend is not None else get_backend()
 
     def generate_Message(self):
         '''
-        Builds the prompt string and passes it to openai, currently using the gpt-4.1-mini model to summarize the text.
+        Builds the prompt string and passes it to the llm backend (openai gpt-4.1-mini by default) to summarize the text.
         Prompt string is build based on the weather_knowledge
 
         @return the summarized text string
         '''
+        # no need to talk to openai if the user does not want a summary. 
+        if self.weather_knowledge == "no_summary":
+            return "\n" + self.afd
+
+        # the same afd at the same level always gets the same summary, so check the cache before paying for an llm call
+        use_cache = bool(self.office and self.issuance_time)
+        if use_cache:
+            cached = get_summary(self.office, self.issuance_time, self.weather_knowledge)
+            if cached is not None:
+                return cached
+
+        try:
+            text = self.backend.complete(self.summary_messages(), temperature=0.7)
+            # only successful summaries get cached, errors should be retried next time
+            if use_cache:
+                store_summary(self.office, self.issuance_time, self.weather_knowledge, text)
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            text = "There was an error generating the summary."
+        
+        return text
+
+    def stream_Message(self):
+        '''
+        Streaming version of generate_Message(), yields the summary a few words at a time as the llm writes it so the page can show
+        text right away instead of waiting on the whole completion
+
+        @return generator of summary text pieces, joined together they are the full summary
+        '''
+        if self.weather_knowledge == "no_summary":
+            yield "\n" + self.afd
+            return
+
+        use_cache = bool(self.office and self.issuance_time)
+        if use_cache:
+            cached = get_summary(self.office, self.issuance_time, self.weather_knowledge)
+            if cached is not None:
+                yield cached
+                return
+
+        pieces = []
+        try:
+            for piece in self.backend.stream(self.summary_messages()):
+                pieces.append(piece)
+                yield piece
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            yield "\n\n(The rest of the summary could not be generated.)" if pieces else "There was an error generating the summary."
+            return
+        # only complete summaries get cached
+        if use_cache:
+            store_summary(self.office, self.issuance_time, self.weather_knowledge, "".join(pieces).strip())
+
+    def summary_messages(self):
+        '''
+        Builds the openai chat messages used to summarize the afd, prompt is based on the weather_knowledge
+
+        @return list of message dictionaries for openai.chat.completions.create
+        '''
         if self.weather_knowledge == "expert":
             prompt_string = """You are a meteorologist and educator. Your task is to write a clear, structured weather summary for a general audience based on the latest NWS Area Forecast Discussion (AFD). Your summary should explain what the weather will be and what is causing it, with a focus on today, tonight, and tomorrow. You may briefly mention days 2-4 only if significant weather is forecast. 
                                 
@@ -105,47 +171,80 @@ class Summarizer:
                                 Maintain a consistent tone and structure.
 
                                 The area forecast discussion is as follows\n"""
-        elif self.weather_knowledge == "no_summary":
-            afd = ""
 
-        afd += "\n" + self.afd
+        # the llm only gets the afd sections this level needs
+        afd += "\n" + compact_afd(self.afd, self.weather_knowledge)
 
-        # no need to talk to openai if the user does not want a summary. 
-        if self.weather_knowledge == "no_summary":
-            text = afd
-        else:
-            # connect to openai
-            openai.api_key = os.getenv("API_KEY") 
-
-            # build messages data structure to pass to openai
-            messages = [
-                {"role": "system", "content": prompt_string},
-                {"role": "user", "content": afd}
-            ]
-            try:
-                # create chat message
-                response = openai.chat.completions.create(
-                    model="gpt-4.1-mini", 
-                    messages=messages,
-                    temperature=0.7
-                )
-                # get response
-                text = response.choices[0].message.content.strip()
-            except Exception as e:
-                print(f"OpenAI API Error: {e}")
-                text = "There was an error generating the summary."
-        
-        return text
+        # build messages data structure to pass to openai
+        return [
+            {"role": "system", "content": prompt_string},
+            {"role": "user", "content": afd}
+        ]
     
-    def explain_text(self, selected_text, summary):
+    def explain_text(self, selected_text, summary, regenerate = False):
         '''
-        Passes the selected text along with the summary and the original afd to explain the selected text. Currently using the gpt-4.1-mini model for explanations.
+        Passes the selected text along with the summary and the original afd to explain the selected text, using the llm backend (openai gpt-4.1-mini by default).
         Prompt determined by the objects weather_knowledge
 
         @param selected_text the selected portion of the summarized text from the webpage, this is the section of text that is supposed to explain the section
         @param summary the summarized forecast discussion, this is important for context
+        @param regenerate true to skip the cached explanation and ask the llm for a new one, false by default
         @return text the explanation generated by the llm. 
         '''
+        # people highlight the same phrases over and over, reuse the explanation unless they asked for a different one
+        key = explanation_key(afd_identity(self.afd, self.issuance_time), summary, selected_text, self.weather_knowledge)
+        if not regenerate:
+            cached = get_explanation(key)
+            if cached is not None:
+                return cached
+
+        try:
+            text = self.backend.complete(
+                self.explanation_messages(selected_text, summary),
+                temperature=0.7 # make the messages a little different each time, this should hopefully allows for slightly different explanation if one doesnt click
+            )
+            store_explanation(key, text)
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            text = "There was an error generating the explanation."
+        
+        return text
+
+    def stream_explanation(self, selected_text, summary, regenerate = False):
+        '''
+        Streaming version of explain_text()
+
+        @param selected_text the selected portion of the summarized text from the webpage
+        @param summary the summarized forecast discussion, this is important for context
+        @param regenerate true to skip the cached explanation and ask the llm for a new one, false by default
+        @return generator of explanation text pieces
+        '''
+        key = explanation_key(afd_identity(self.afd, self.issuance_time), summary, selected_text, self.weather_knowledge)
+        if not regenerate:
+            cached = get_explanation(key)
+            if cached is not None:
+                yield cached
+                return
+
+        pieces = []
+        try:
+            for piece in self.backend.stream(self.explanation_messages(selected_text, summary)):
+                pieces.append(piece)
+                yield piece
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            yield "\n\n(The rest of the explanation could not be generated.)" if pieces else "There was an error generating the explanation."
+            return
+        store_explanation(key, "".join(pieces).strip())
+
+    def explanation_messages(self, selected_text, summary):
+        '''
+        Builds the openai chat messages used to explain a piece of the summary, prompt is based on the weather_knowledge
+
+        @param selected_text the selected portion of the summarized text from the webpage
+        @param summary the summarized forecast discussion
+        @return list of message dictionaries for openai.chat.completions.create
+        '''
         if self.weather_knowledge == "expert":
             prompt_string = """You are a meteorologist and educator. user is reading a summarized weather forecast that was generated from an official National Weather Service Area Forecast Discussion (AFD). 
                                 Your job is to clearly explain what that selected text means, using context from both the original AFD and the summary.
@@ -257,29 +356,15 @@ class Summarizer:
                                 
                                 The original afd and summary will be entered in the chat, make sure to use them to gain context for the selected section. \n"""
 
-        afd += "\n The original Area forecast discussion is as follows: \n" + self.afd + "\n\n"
+        afd += "\n The original Area forecast discussion is as follows: \n" + compact_afd(self.afd, self.weather_knowledge) + "\n\n"
         afd += "The summarized discussion is as follows: \n" + summary + "\n\n"
 
-        afd += "The selected piece of text from the summarized discussion is what you should explain to the user at the specified level" + selected_text + "\n"
-
-        openai.api_key = os.getenv("API_KEY") 
+        selected = "The selected piece of text from the summarized discussion is what you should explain to the user at the specified level" + selected_text + "\n"
 
-        # build messages datastructure 
-        messages = [
+        # build messages datastructure. The selected text goes in its own last message so every explanation of the same summary
+        # starts with the exact same messages, which lets the provider reuse its cached prompt prefix
+        return [
             {"role": "system", "content": prompt_string},
-            {"role": "user", "content": afd}
+            {"role": "user", "content": afd},
+            {"role": "user", "content": selected}
         ]
-        try:
-            
-            response = openai.chat.completions.create(
-                model="gpt-4.1-mini", 
-                messages=messages,
-                temperature=0.7 # make the messages a little different each time, this should hopefully allows for slightly different explanation if one doesnt click
-            )
-            # get reponse
-            text = response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"OpenAI API Error: {e}")
-            text = "There was an error generating the explanation."
-        
-        return text
\ No newline at end of file
@@ -0,0 +1,53 @@
+import os
+from backend.cache import PersistentCache, CACHE_DIR
+'''
+Persistent cache of LLM summaries. A summary only depends on the afd and the weather knowledge level, and every user of the same
+office shares one afd, so summaries are keyed on (forecast office, afd issuance time, knowledge level, prompt version). When a
+newer afd is summarized for an office, summaries of that offices older afds are dropped since nobody will ask for them again.
+'''
+PROMPT_VERSION = "2"
+''' Bump whenever the prompts in summarizer.py or the afd compaction in afd_parser.py change so summaries made with the old prompts are not reused'''
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", str(2 * 24 * 3600)))
+''' Seconds a summary stays cached, afds are reissued a few times a day so 2 days is plenty'''
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1000"))
+''' Max number of summaries kept'''
+
+_summary_cache = PersistentCache(os.path.join(CACHE_DIR, "summaries.json"), SUMMARY_CACHE_TTL, SUMMARY_CACHE_SIZE)
+
+def summary_key(office, issuance_time, weather_knowledge):
+    '''
+    @param office three letter forecast office id
+    @param issuance_time the afds issuanceTime from NWS
+    @param weather_knowledge "none", "moderate", or "expert"
+    @return the cache key string
+    '''
+    return "|".join([office, issuance_time, weather_knowledge, PROMPT_VERSION])
+
+def get_summary(office, issuance_time, weather_knowledge):
+    '''
+    @param office three letter forecast office id
+    @param issuance_time the afds issuanceTime from NWS
+    @param weather_knowledge "none", "moderate", or "expert"
+    @return the cached summary, None if this afd has not been summarized at this level
+    '''
+    return _summary_cache.get(summary_key(office, issuance_time, weather_knowledge))
+
+def store_summary(office, issuance_time, weather_knowledge, summary):
+    '''
+    Saves a summary and drops any summaries of afds this one supersedes
+
+    @param office three letter forecast office id
+    @param issuance_time the afds issuanceTime from NWS
+    @param weather_knowledge "none", "moderate", or "expert"
+    @param summary the summarized text
+    '''
+    _summary_cache.set(summary_key(office, issuance_time, weather_knowledge), summary)
+
+    # issuance times are all ISO 8601 UTC strings from NWS so they compare correctly as strings
+    superseded = []
+    for key in _summary_cache.keys():
+        key_office, key_issuance = key.split("|")[:2]
+        if key_office == office and key_issuance < issuance_time:
+            superseded.append(key)
+    if superseded:
+        _summary_cache.delete(*superseded)
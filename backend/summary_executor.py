@@ -0,0 +1,82 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from backend.summarizer import Summarizer
+'''
+Concurrent summarization for the email batch. Every user due an email needs a summary of their offices afd at their knowledge
+level, but many users share an (afd, level) pair and the rest are independent of each other. The executor takes every job up
+front, runs each unique (afd, level) once, and keeps up to SUMMARY_WORKERS LLM calls in flight at a time instead of making them
+one after another.
+'''
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "4"))
+''' Max number of LLM summary calls in flight at once during a batch'''
+
+def summary_job_key(weather_knowledge, afd, office=None, issuance_time=None):
+    '''
+    @param weather_knowledge the knowledge level the summary is for
+    @param afd the area forecast discussion text
+    @param office the forecast office that issued the afd, if known
+    @param issuance_time the afds issuanceTime from NWS, if known
+    @return key that is the same for every job that would produce the same summary
+    '''
+    if office and issuance_time:
+        return (office, issuance_time, weather_knowledge)
+    return (hashlib.sha256(afd.encode("utf-8")).hexdigest(), weather_knowledge)
+
+class SummaryExecutor:
+    '''
+    SummaryExecutor Class. Bounded thread pool for Summarizer.generate_Message() calls that hands every caller asking for the
+    same (afd, level) the same future. Meant to live for one batch, use it as a context manager so the pool is shut down after.
+    '''
+    def __init__(self, max_workers=SUMMARY_WORKERS, backend=None):
+        '''
+        SummaryExecutor object initialization method (constructor)
+
+        @param max_workers max number of summaries generated at once
+        @param backend LLMBackend passed to every Summarizer, the default backend if None
+        '''
+        self.backend = backend
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summarize")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.deduped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def submit(self, weather_knowledge, afd, office=None, issuance_time=None):
+        '''
+        Queues a summary, or joins the job already queued for the same afd and level
+
+        @param weather_knowledge the knowledge level the summary is for
+        @param afd the area forecast discussion text
+        @param office the forecast office that issued the afd, lets the summary cache be used
+        @param issuance_time the afds issuanceTime from NWS, lets the summary cache be used
+        @return future whose result is the summary text
+        '''
+        key = summary_job_key(weather_knowledge, afd, office, issuance_time)
+        with self._lock:
+            self.submitted += 1
+            future = self._jobs.get(key)
+            if future is not None:
+                self.deduped += 1
+                return future
+            summarizer = Summarizer(weather_knowledge, afd, office, issuance_time, self.backend)
+            future = self._jobs[key] = self._pool.submit(summarizer.generate_Message)
+            return future
+
+    def stats(self):
+        '''
+        @return dictionary with the number of jobs submitted, how many of them shared another job, and the unique jobs run
+        '''
+        with self._lock:
+            return {"submitted": self.submitted, "deduped": self.deduped, "unique": len(self._jobs)}
+
+    def shutdown(self):
+        ''' Waits for the queued summaries to finish and stops the worker threads '''
+        self._pool.shutdown(wait=True)
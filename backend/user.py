@@ -1,13 +1,10 @@
 import re
 from timezonefinder import TimezoneFinder
 from geopy.geocoders import Nominatim
-import requests
-import json
-import os
 from requests.exceptions import HTTPError, Timeout, RequestException
 from zoneinfo import ZoneInfo
 from datetime import datetime, timezone
-from filelock import FileLock
+from backend.geocoder import geocode
 ''' 
 User Object for WeatherBear Project. Will contain information on users name, location, unit preferance, email address, 
 and a level of weather knowledge
@@ -21,10 +18,7 @@ EMAIL_REGEX = re.compile(r"^\S+@\S+\.\S+$")
 _geolocator = Nominatim(user_agent="weatherbear")
 # time zone finder object, used to get users time zone from the 
 _tz_finder = TimezoneFinder()
-# USER_PATH path to users.json on server, this path does not exist on local machine or repo
-USER_PATH = "/mnt/data/users.json"
-# LOCK PATH for file locking to avoid race conditions
-LOCK_PATH = USER_PATH + ".lock"
+# users are stored in the sqlite database in backend/user_store.py
 
 class User:
     '''
@@ -133,20 +127,16 @@ class User:
 
     def get_time_zone(self):
         '''
-        Uses OpenStreetMap API to get lat/lon and then TimezoneFinder to get timezone
+        Uses OpenStreetMap API (thru the cached geocoder) to get lat/lon and then TimezoneFinder to get timezone
         '''
         try:
-            # Try to get time zone from location using openstreetmap api based on the users location
-            url = f"https://nominatim.openstreetmap.org/search?q={self.location}&format=json&limit=1"
-            response = requests.get(url, headers={"User-Agent": "WeatherBearApp/1.0"})
-            response.raise_for_status()
-            data = response.json()
+            # Try to get time zone from location using openstreetmap api based on the users location, shares the geocode cache with Data_Fetcher
+            coords = geocode(self.location)
 
-            if not data:
+            if not coords:
                 raise ValueError(f"Could not find location for: {self.location}")
 
-            lat = float(data[0]["lat"])
-            lon = float(data[0]["lon"])
+            lat, lon = coords
 
             # use timezone finder object
             tz = _tz_finder.timezone_at(lat=lat, lng=lon)
@@ -211,55 +201,3 @@ class User:
             "preferences": self.preferences,
             "timeZone": self.timeZone
         }
-
-def load_users():
-    ''' 
-    Loads users from the database.
-
-    @return a list of user objects pulled from the users.json file
-    '''
-    lock = FileLock(LOCK_PATH)
-    with lock: 
-        # Used to set up a users.json file when first deploying app
-        if not os.path.exists(USER_PATH):
-            os.makedirs(os.path.dirname(USER_PATH), exist_ok=True)
-            print("creating empty one")
-            with open(USER_PATH, "w") as f:
-                json.dump([], f)
-
-        try:
-            with open(USER_PATH, "r") as f:
-                users_data = json.load(f)
-            return [User(
-                name=user_dict["name"],
-                location=user_dict["location"],
-                email=user_dict["email"],
-                preferences=user_dict.get("preferences", {}),
-                timeZone=user_dict.get("timeZone")
-            ) for user_dict in users_data]
-        except FileNotFoundError:
-            return []
-        
-def save_users(users):
-    ''' 
-    Handles saving users to db 
-    
-    @param a list of users to save to the users.json file
-    '''
-    os.makedirs(os.path.dirname(USER_PATH), exist_ok=True)
-    lock = FileLock(LOCK_PATH)
-    with lock:
-        with open(USER_PATH, "w") as f:
-            json.dump([u.to_dict() for u in users], f, indent=2)
-    
-def find_user_by_email(email, users):
-        ''' 
-        Finds a user by email address. Simply iterates thru list of users and checks if an email already exists in the list. 
-
-        @param email email address to be found
-        @param users list to be searced
-        '''
-        for user in users:
-            if user.email.lower() == email.lower():
-                return user
-        return None
\ No newline at end of file
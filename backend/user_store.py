@@ -0,0 +1,279 @@
+import os
+import json
+import sqlite3
+import threading
+from zoneinfo import ZoneInfo
+from datetime import datetime, timezone
+from backend.user import User
+'''
+SQLite backed user store, replaces rewriting all of users.json on every signup, unsubscribe, and scheduler tick. Every user is
+one row keyed by email, signups and unsubscribes touch only that row, and the hours users want their emails are kept in an
+indexed send_slots table so the scheduler only loads the users whose local hour it is instead of every user.
+
+The first time the database is opened it is filled from users.json if that file exists (the json file is left in place as a backup).
+'''
+USER_DB_PATH = os.getenv("USER_DB_PATH", "/mnt/data/users.db")
+''' Path to the sqlite user database on the server, next to where users.json used to be'''
+USER_JSON_PATH = "/mnt/data/users.json"
+''' The old json user list, migrated into the database once'''
+
+# bump and add a step to _init_db() when the schema changes
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    email       TEXT PRIMARY KEY COLLATE NOCASE,
+    name        TEXT NOT NULL,
+    location    TEXT NOT NULL,
+    time_zone   TEXT NOT NULL,
+    preferences TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS send_slots (
+    email       TEXT NOT NULL COLLATE NOCASE REFERENCES users(email) ON DELETE CASCADE,
+    time_zone   TEXT NOT NULL,
+    local_hour  INTEGER NOT NULL,
+    PRIMARY KEY (email, local_hour)
+);
+CREATE INDEX IF NOT EXISTS send_slots_by_hour ON send_slots (time_zone, local_hour);
+'''
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+def connect(path=None):
+    '''
+    @param path database path, USER_DB_PATH if None
+    @return this threads connection to the database, opened (and the schema created / json migrated) on first use
+    '''
+    path = path or USER_DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # autocommit mode, writes use explicit transactions through _transaction()
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with _init_lock:
+            if path not in _initialized:
+                _init_db(conn)
+                _initialized.add(path)
+        connections[path] = conn
+    return conn
+
+class _transaction:
+    '''
+    Runs a block of statements as one write transaction, taking the write lock up front so two processes can not interleave
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+def _init_db(conn, json_path=None):
+    '''
+    Creates the tables and runs the one time users.json migration
+
+    @param conn sqlite connection
+    @param json_path the old users.json file, USER_JSON_PATH if None
+    '''
+    json_path = json_path or USER_JSON_PATH
+    conn.executescript(SCHEMA)
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    # built before the write lock is taken, a legacy user without a time zone is geocoded over the network and the scheduler and
+    # web writers should not wait on that
+    users = load_json_users(json_path)
+    with _transaction(conn):
+        # checked again inside the write transaction so only one process ever migrates
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        migrated = migrate_from_json(conn, users)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    if migrated:
+        print(f"Migrated {migrated} users from {json_path} to the user database")
+
+def load_json_users(json_path=USER_JSON_PATH):
+    '''
+    Reads the old users.json, filling in the time zone of users saved without one
+
+    @param json_path the old users.json file
+    @return list of User objects, empty if the file does not exist
+    '''
+    if not os.path.exists(json_path):
+        return []
+    with open(json_path, "r") as f:
+        users_data = json.load(f)
+
+    users = []
+    for user_dict in users_data:
+        try:
+            users.append(User(
+                name=user_dict["name"],
+                location=user_dict["location"],
+                email=user_dict["email"],
+                preferences=user_dict.get("preferences", {}),
+                timeZone=user_dict.get("timeZone")
+            ))
+        except (KeyError, ValueError) as e:
+            print(f"Skipping user that could not be migrated: {e}")
+    return users
+
+def migrate_from_json(conn, users):
+    '''
+    Copies the users from users.json into the database, users already in the database are left alone
+
+    @param conn sqlite connection, inside a transaction
+    @param users list of User objects from load_json_users()
+    @return number of users copied
+    '''
+    return sum(1 for user in users if _insert(conn, user))
+
+def _insert(conn, user):
+    '''
+    @param conn sqlite connection, inside a transaction
+    @param user User object
+    @return true if the user was added, false if a user with that email already exists
+    '''
+    cursor = conn.execute(
+        "INSERT INTO users (email, name, location, time_zone, preferences) VALUES (?, ?, ?, ?, ?) ON CONFLICT(email) DO NOTHING",
+        (user.email, user.name, user.location, user.timeZone, json.dumps(user.preferences)))
+    if cursor.rowcount == 0:
+        return False
+    _set_send_slots(conn, user)
+    return True
+
+def _set_send_slots(conn, user):
+    '''
+    Replaces the users rows in send_slots with their current send hours and time zone
+
+    @param conn sqlite connection, inside a transaction
+    @param user User object
+    '''
+    conn.execute("DELETE FROM send_slots WHERE email = ?", (user.email,))
+    conn.executemany("INSERT INTO send_slots (email, time_zone, local_hour) VALUES (?, ?, ?)",
+                     [(user.email, user.timeZone, hour) for hour in set(user.send_hours)])
+
+def _row_to_user(row):
+    '''
+    @param row sqlite row from the users table
+    @return the User object, no geocoding since the time zone is stored
+    '''
+    return User(
+        name=row["name"],
+        location=row["location"],
+        email=row["email"],
+        preferences=json.loads(row["preferences"]),
+        timeZone=row["time_zone"]
+    )
+
+def upsert_user(user, path=None):
+    '''
+    Adds a user, or replaces the name, location, time zone, and preferences of the user with the same email
+
+    @param user User object
+    @param path database path, USER_DB_PATH if None
+    @return true if the user is new, false if an existing user was updated
+    '''
+    conn = connect(path)
+    with _transaction(conn):
+        if _insert(conn, user):
+            return True
+        conn.execute("UPDATE users SET name = ?, location = ?, time_zone = ?, preferences = ? WHERE email = ?",
+                     (user.name, user.location, user.timeZone, json.dumps(user.preferences), user.email))
+        _set_send_slots(conn, user)
+        return False
+
+def delete_user(email, path=None):
+    '''
+    Removes a user and their send slots
+
+    @param email the users email address, any case
+    @param path database path, USER_DB_PATH if None
+    @return true if a user was removed
+    '''
+    conn = connect(path)
+    with _transaction(conn):
+        return conn.execute("DELETE FROM users WHERE email = ?", (email,)).rowcount > 0
+
+def get_user(email, path=None):
+    '''
+    @param email the users email address, any case
+    @param path database path, USER_DB_PATH if None
+    @return the User object, None if there is no user with that email
+    '''
+    row = connect(path).execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+    return _row_to_user(row) if row else None
+
+def all_users(path=None):
+    '''
+    @param path database path, USER_DB_PATH if None
+    @return list of every User object
+    '''
+    return [_row_to_user(row) for row in connect(path).execute("SELECT * FROM users")]
+
+def location_levels(path=None):
+    '''
+    @param path database path, USER_DB_PATH if None
+    @return set of distinct (location, weather_knowledge) pairs users have, users without a summary level left out
+    '''
+    rows = connect(path).execute(
+        "SELECT DISTINCT location, json_extract(preferences, '$.weather_knowledge') AS level FROM users "
+        "WHERE level IS NOT NULL AND level != '' AND level != 'no_summary'")
+    return {(row["location"], row["level"]) for row in rows}
+
+def due_users(now_utc=None, path=None):
+    '''
+    Finds the users who should get an email this hour. Only the users with a send slot at the current local hour of their time zone
+    are loaded, then should_get_email() checks (and records) that they have not been sent this hour yet
+
+    @param now_utc the current utc time, now if None
+    @param path database path, USER_DB_PATH if None
+    @return list of User objects due an email, save the recorded hour with update_times_sent() once they are sent
+    '''
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+    conn = connect(path)
+
+    # the local hour right now in every time zone that has users, a few dozen zones at most
+    slots = []
+    for (time_zone,) in conn.execute("SELECT DISTINCT time_zone FROM send_slots"):
+        try:
+            slots.append((time_zone, now_utc.astimezone(ZoneInfo(time_zone)).hour))
+        except Exception as e:
+            print(f"invalid time zone {time_zone}: {e}")
+    if not slots:
+        return []
+
+    # one indexed lookup per (time zone, hour) slot
+    users = []
+    for time_zone, hour in slots:
+        rows = conn.execute("SELECT users.* FROM send_slots JOIN users ON users.email = send_slots.email "
+                            "WHERE send_slots.time_zone = ? AND send_slots.local_hour = ?", (time_zone, hour))
+        users.extend(_row_to_user(row) for row in rows)
+    return [user for user in users if user.should_get_email(now_utc)]
+
+def update_times_sent(users, path=None):
+    '''
+    Saves the recorded send hours of users that were just sent, one row update per user
+
+    @param users list of User objects from due_users()
+    @param path database path, USER_DB_PATH if None
+    '''
+    if not users:
+        return
+    conn = connect(path)
+    with _transaction(conn):
+        # only the send history changes, so a preference change made while the batch ran is kept
+        conn.executemany("UPDATE users SET preferences = json_set(preferences, '$.times_sent', json(?)) WHERE email = ?",
+                         [(json.dumps(user.times_sent), user.email) for user in users])
@@ -16,6 +16,34 @@ function clearErrorMessage() {
   }
 }
 
+// Reads a server-sent event stream from a fetch response, calling onEvent(name, data) for every event as it arrives
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // events are separated by a blank line, keep any partial event for the next read
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let name = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event:")) name = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      onEvent(name, data ? JSON.parse(data) : {});
+    }
+  }
+}
+
 async function handleTextExplanation() {
   if (!explanationEnabled) return;
 
@@ -35,28 +63,73 @@ async function handleTextExplanation() {
       "absolute z-50 bg-white text-sm text-gray-800 border border-gray-300 rounded-xl shadow-lg p-2 max-w-xs";
     popup.style.top = `${rect.bottom + window.scrollY + 5}px`;
     popup.style.left = `${rect.left + window.scrollX}px`;
-    popup.textContent = "Loading explanation...";
+    const popupText = document.createElement("div");
+    popupText.textContent = "Loading explanation...";
+    popup.appendChild(popupText);
+
+    // explanations are cached on the server, this asks for a new one if the cached one did not help
+    const regenerateButton = document.createElement("button");
+    regenerateButton.type = "button";
+    regenerateButton.className = "mt-1 text-xs text-blue-600 hover:underline";
+    regenerateButton.textContent = "Explain it differently";
+    regenerateButton.style.display = "none";
+    popup.appendChild(regenerateButton);
 
     document.body.appendChild(popup);
 
-    try {
-      const response = await fetch("/explain-text", {
+    // the server keeps the afd & summary, so normally only the context id and selection are sent
+    const requestExplanation = (sendFullContext, regenerate) =>
+      fetch("/explain-text-stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          text: selectedText,
-          summary: summaryText.textContent,
-          afd: fullAfdText,
-          expertise: currentExpertiseLevel
-        })
+        body: JSON.stringify(
+          sendFullContext
+            ? {
+                text: selectedText,
+                summary: summaryText.textContent,
+                afd: fullAfdText,
+                expertise: currentExpertiseLevel,
+                regenerate: regenerate
+              }
+            : { text: selectedText, context_id: currentContextId, regenerate: regenerate }
+        )
       });
 
-      const data = await response.json();
-      popup.textContent = data.explanation || "No explanation found.";
-    } catch (error) {
-      console.error("Error fetching explanation:", error);
-      popup.textContent = "Error getting explanation.";
-    }
+    const loadExplanation = async (regenerate) => {
+      regenerateButton.style.display = "none";
+      popupText.textContent = "Loading explanation...";
+      try {
+        let response = await requestExplanation(!currentContextId, regenerate);
+        if (response.status === 410) {
+          // context expired on the server, send everything once so it can be registered again
+          response = await requestExplanation(true, regenerate);
+        }
+
+        if (!response.ok) {
+          const data = await response.json();
+          popupText.textContent = data.explanation || "No explanation found.";
+        } else {
+          // show the explanation as it is written
+          let explanation = "";
+          await readEventStream(response, (name, data) => {
+            if (name === "text") {
+              explanation += data.text;
+              popupText.textContent = explanation;
+            } else if (name === "done" && data.context_id) {
+              currentContextId = data.context_id;
+            }
+          });
+          if (!explanation) popupText.textContent = "No explanation found.";
+          regenerateButton.style.display = "block";
+        }
+      } catch (error) {
+        console.error("Error fetching explanation:", error);
+        popupText.textContent = "Error getting explanation.";
+      }
+    };
+
+    regenerateButton.addEventListener("click", () => loadExplanation(true));
+    await loadExplanation(false);
 
     const handleClickOutside = (e) => {
       if (!popup.contains(e.target)) {
@@ -71,6 +144,7 @@ async function handleTextExplanation() {
 
 let fullAfdText = "";
 let currentExpertiseLevel = "";
+let currentContextId = "";
 
 window.addEventListener("DOMContentLoaded", () => {
   const form = document.getElementById("location-form");
@@ -146,7 +220,7 @@ window.addEventListener("DOMContentLoaded", () => {
     submitButton.textContent = "Loading...";
 
     try {
-      const response = await fetch("/get-summary", {
+      const response = await fetch("/get-summary-stream", {
         method: "POST",
         body: formData
       });
@@ -164,18 +238,29 @@ window.addEventListener("DOMContentLoaded", () => {
       }
 
       clearErrorMessage(); // Clear any prior error
-      const data = await response.json();
 
       // Animate form shrinking and moving upward
       form.classList.add("opacity-80", "scale-95", "-translate-y-4");
 
-      // Capture afd and expertise vals from frontend
-      fullAfdText = data.afd;
+      // Capture expertise val from frontend
       currentExpertiseLevel = document.getElementById("expertise").value;
 
-      // Show summary
-      summaryText.textContent = data.summary;
+      // Show summary panel right away and fill it in as the summary streams in
+      summaryText.textContent = "";
       summaryPanel.classList.remove("hidden");
+      currentContextId = "";
+
+      await readEventStream(response, (name, data) => {
+        if (name === "meta") {
+          fullAfdText = data.afd;
+        } else if (name === "text") {
+          // first words are in, the spinner is no longer needed
+          spinner.style.display = "none";
+          summaryText.textContent += data.text;
+        } else if (name === "done") {
+          currentContextId = data.context_id || "";
+        }
+      });
 
       // reset explain toggle
       const explainToggle = document.getElementById("explain-toggle");
@@ -0,0 +1,55 @@
+import math
+import random
+import timeit
+from backend.data_fetcher import Data_Fetcher
+from backend.station_index import StationIndex
+
+'''
+Micro-benchmark of the nearest observation station search. Compares the old loop that calls Data_Fetcher.haversine() once per
+station against the numpy StationIndex (built once, queried many times) for station lists of a few different sizes.
+Run from the repo root with: PYTHONPATH=. python test/bench_station_index.py
+'''
+
+def make_stations(n, seed=0):
+    ''' builds n fake station features scattered around the continental US '''
+    rng = random.Random(seed)
+    return [{
+        'properties': {'stationIdentifier': f"K{i:04d}"},
+        'geometry': {'coordinates': [rng.uniform(-125, -67), rng.uniform(25, 49)]}
+    } for i in range(n)]
+
+def loop_nearest(df, stations, lat, lon):
+    ''' the original search from Data_Fetcher.get_forecast_office() '''
+    closest_station = None
+    min_dist = math.inf
+    for station in stations:
+        station_coords = station['geometry']['coordinates']
+        dist = df.haversine(lon, lat, station_coords[0], station_coords[1])
+        if dist < min_dist:
+            min_dist = dist
+            closest_station = station
+    return closest_station
+
+def bench_station_index(sizes=(100, 250, 500, 1000), queries=200):
+    df = Data_Fetcher("35.78,-78.64", "imperial")
+    rng = random.Random(1)
+    points = [(rng.uniform(25, 49), rng.uniform(-125, -67)) for _ in range(queries)]
+
+    for n in sizes:
+        stations = make_stations(n)
+        index = StationIndex(stations)
+
+        # both searches have to agree before the timings mean anything
+        for lat, lon in points[:20]:
+            assert loop_nearest(df, stations, lat, lon) is index.nearest(lat, lon)
+
+        loop_time = timeit.timeit(lambda: [loop_nearest(df, stations, lat, lon) for lat, lon in points], number=1)
+        build_time = timeit.timeit(lambda: StationIndex(stations), number=10) / 10
+        index_time = timeit.timeit(lambda: [index.nearest(lat, lon) for lat, lon in points], number=1)
+
+        print(f"{n:>5} stations: loop {loop_time / queries * 1e6:8.1f} us/query | "
+              f"index {index_time / queries * 1e6:8.1f} us/query (build {build_time * 1e6:.0f} us) | "
+              f"speedup {loop_time / index_time:.1f}x")
+
+if __name__ == "__main__":
+    bench_station_index()
@@ -0,0 +1,58 @@
+import time
+import timeit
+from backend.llm_backend import StubBackend
+from backend.summarizer import Summarizer
+from backend.summary_executor import SummaryExecutor
+
+'''
+Offline benchmark of the summarize path using the StubBackend, no network or api key needed. Measures how much time our own
+code (afd compaction, prompt building, the executor) adds on top of the LLM, and how batch throughput scales with the number of
+summary workers when the LLM takes a fixed amount of time per call.
+Run from the repo root with: PYTHONPATH=. python test/bench_summarizer.py
+'''
+
+def make_afd(office):
+    ''' builds a realistic sized fake afd for an office '''
+    paragraph = (f"A cold front will approach the {office} area tonight with scattered storms ahead of it. MLCAPE near 2000 J/kg "
+                 "and 30 kt of deep layer shear will support a few strong to severe storms with damaging winds.\n\n")
+    sections = ["SYNOPSIS", "NEAR TERM /THROUGH TONIGHT/", "SHORT TERM /THURSDAY THROUGH FRIDAY NIGHT/",
+                "LONG TERM /SATURDAY THROUGH TUESDAY/", "AVIATION /18Z WEDNESDAY THROUGH MONDAY/", "MARINE", "FIRE WEATHER"]
+    body = "".join(f".{name}...\n{paragraph * 6}&&\n\n" for name in sections)
+    return f"000\nFXUS62 K{office} 181845\nAFD{office}\n\nArea Forecast Discussion\n245 PM EDT Wed Jun 18 2025\n\n{body}$$\n"
+
+def bench_overhead(iterations=200):
+    afd = make_afd("RAH")
+    # nothing is cached without an office & issuance time, so every call goes through prompt building and the backend
+    stub = StubBackend(latency=0, word_seconds=0)
+    build_time = timeit.timeit(lambda: Summarizer("moderate", afd, backend=stub).summary_messages(), number=iterations)
+    call_time = timeit.timeit(lambda: Summarizer("moderate", afd, backend=stub).generate_Message(), number=iterations)
+    print(f"prompt build {build_time / iterations * 1e3:.2f} ms | full generate_Message with a zero latency llm "
+          f"{call_time / iterations * 1e3:.2f} ms")
+
+def bench_throughput(latency=0.2, offices=10, users_per_job=3, worker_counts=(1, 4, 8, 16)):
+    levels = ["none", "moderate", "expert"]
+    jobs = [(level, make_afd(f"X{i:02d}")) for i in range(offices) for level in levels] * users_per_job
+    print(f"{len(jobs)} users, {offices * len(levels)} unique (afd, level) jobs, {latency * 1e3:.0f} ms simulated llm latency")
+
+    stub = StubBackend(latency=latency, word_seconds=0)
+    start = time.perf_counter()
+    for level, afd in jobs:
+        Summarizer(level, afd, backend=stub).generate_Message()
+    serial = time.perf_counter() - start
+    print(f"  serial, one call per user: {serial:6.2f} s ({stub.calls} llm calls)")
+
+    for workers in worker_counts:
+        stub = StubBackend(latency=latency, word_seconds=0)
+        start = time.perf_counter()
+        with SummaryExecutor(workers, backend=stub) as executor:
+            futures = [executor.submit(level, afd) for level, afd in jobs]
+            [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        # anything over the ideal (unique jobs / workers * latency) is our own overhead
+        ideal = -(-offices * len(levels) // workers) * latency
+        print(f"  executor, {workers:>2} workers: {elapsed:6.2f} s ({stub.calls} llm calls, "
+              f"overhead {max(elapsed - ideal, 0) * 1e3:.0f} ms, {serial / elapsed:.1f}x faster)")
+
+if __name__ == "__main__":
+    bench_overhead()
+    bench_throughput()
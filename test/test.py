@@ -3,6 +3,9 @@ from backend.summarizer import Summarizer
 from backend.emailer import Emailer
 from backend.user import User
 from datetime import datetime
+from email.message import EmailMessage
+from backend.smtp_pool import SMTPPool
+from backend.smtp_standin import LocalSMTPServer
 
 def test_get_latlon():
     df = Data_Fetcher("Pinehurst", "metric")
@@ -68,3 +71,94 @@ def test_emailer():
 
 #print(email)
 
+def test_smtp_pool():
+    # sends through the pool to the local stand-in server, no real email goes out
+    server = LocalSMTPServer().start()
+    pool = SMTPPool("127.0.0.1", server.port, "weatherbear", "password", starttls=False, size=2)
+    for i in range(10):
+        message = EmailMessage()
+        message['Subject'] = f"Test {i}"
+        message['From'] = "weatherbear.emailbot@gmail.com"
+        message['To'] = f"user{i}@example.com"
+        message.set_content("Stay weather aware!")
+        pool.send(message)
+
+    # 10 emails should only need a couple of connections & logins
+    print(f"sent {len(server.messages)} emails over {server.connections} connections, {server.logins} logins")
+    pool.close()
+    server.stop()
+    return server.messages
+
+#messages = test_smtp_pool()
+
+def test_county_alerts():
+    # offline, a tornado warning issued by county (NCC183) has to reach a Wake County user whose forecast zone is NCZ041
+    from backend.alerts import AlertService, ugc_codes
+    feed = {"features": [
+        {"properties": {"event": "Tornado Warning", "headline": "Tornado Warning issued for Wake County", "geocode": {"UGC": ["NCC183"]}}},
+        {"properties": {"event": "Heat Advisory", "headline": "Heat Advisory issued", "geocode": {"UGC": ["NCZ041", "NCC183"]}}},
+        {"properties": {"event": "Flood Watch", "headline": "Flood Watch issued", "geocode": {"UGC": ["NCZ042"]}}},
+    ]}
+    service = AlertService()
+    service.load(feed)
+
+    zone_ids = ugc_codes("https://api.weather.gov/zones/forecast/NCZ041", "https://api.weather.gov/zones/county/NCC183")
+    events = [alert['event'] for alert in service.alerts_for_zones(zone_ids)]
+    # the advisory covers both codes but is only listed once
+    assert events == ["Heat Advisory", "Tornado Warning"], events
+    print(events)
+    return events
+
+#events = test_county_alerts()
+
+def test_metric_forecast_text():
+    # offline, every temperature phrasing in NWS forecast text has to come out in celsius for metric users
+    from backend.forecast_store import convert_forecast_text
+    cases = {
+        "Sunny, with a high near 96. Southwest wind 8 to 12 mph.": "Sunny, with a high near 36. Southwest wind 13 to 19 km/h.",
+        "Mostly sunny. Highs in the mid 90s.": "Mostly sunny. Highs around 35.",
+        "Clear. Lows in the upper 30s.": "Clear. Lows around 3.",
+        "Highs in the upper 50s to lower 60s.": "Highs from 13 to 17.",
+        "Lows in the mid to upper 70s.": "Lows from 23 to 26.",
+        "Lows in the lower teens.": "Lows around -11.",
+        "Highs 85 to 90.": "Highs 29 to 32.",
+        "Lows around 10 below zero.": "Lows around -23.",
+        "Heat index values as high as 103. Chance of precipitation is 40%.": "Heat index values as high as 39. Chance of precipitation is 40%.",
+        "Lows 20 to 25 below zero.": "Lows -29 to -32.",
+        # numbers that are not temperatures are left alone
+        "New rainfall amounts around 0.1 inches possible.": "New rainfall amounts around 0.1 inches possible.",
+        "Visibility near 1 mile in fog.": "Visibility near 1 mile in fog.",
+        "Snow level near 5000 feet.": "Snow level near 5000 feet.",
+        "Seas around 3 ft.": "Seas around 3 ft.",
+        "Winds near 25 kt.": "Winds near 25 kt.",
+    }
+    for text, expected in cases.items():
+        converted = convert_forecast_text(text)
+        assert converted == expected, (text, converted)
+    print(f"{len(cases)} forecast texts converted")
+    return cases
+
+#cases = test_metric_forecast_text()
+
+def test_planner_without_station():
+    # offline, a location whose grid has no observation stations fails on its own instead of crashing the whole batch
+    from backend.batch_planner import BatchPlanner
+    from backend.data_fetcher import ForecastError
+    originals = (Data_Fetcher.get_latlon, Data_Fetcher.get_forecast_office)
+    Data_Fetcher.get_latlon = lambda self: (35.8, -78.6)
+    Data_Fetcher.get_forecast_office = lambda self, lat, lon: ("RAH", 10, 20, "https://api.weather.gov/zones/forecast/NCZ041", None)
+    try:
+        user = User("Chris", "35.8,-78.6", "chris@example.com", preferences={"units": "imperial", "weather_knowledge": "moderate"}, timeZone="UTC")
+        planner = BatchPlanner([user]).run()
+        failures = []
+        jobs = list(planner.jobs(on_error=lambda job, stage, error: failures.append(error)))
+        stats = planner.stats()
+    finally:
+        Data_Fetcher.get_latlon, Data_Fetcher.get_forecast_office = originals
+
+    assert jobs == [] and isinstance(failures[0], ForecastError), failures
+    assert stats["stations"] == 0 and stats["fetched"] == 0, stats
+    print(f"failed with: {failures[0]}, plan {stats}")
+    return stats
+
+#stats = test_planner_without_station()